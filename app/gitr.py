@@ -2,13 +2,25 @@
 ## SECTION: Imports                                             #
 ##==============================================================#
 
+import hashlib
 import io
+import json
+import os
+import re
+import shutil
 import sys
+import tarfile
+import tempfile
+import threading
 import os.path as op
 
-import auxly.filesys as fsys
-import qprompt
-import requests
+from utilconf import LazyModule
+
+# These are only needed when a remote template is actually downloaded.
+fsys = LazyModule("auxly.filesys")
+mpool = LazyModule("multiprocessing.pool")
+qprompt = LazyModule("qprompt")
+requests = LazyModule("requests")
 
 ##==============================================================#
 ## SECTION: Setup                                               #
@@ -30,10 +42,94 @@ GHAPI = "https://api.github.com/repos/"
 GHURL = "https://github.com/"
 GHRAW = "https://raw.githubusercontent.com/"
 
+#: Maximum number of concurrent requests used when downloading a directory.
+JOBS = 8
+
+#: Size in bytes of the chunks used when streaming downloads to disk.
+CHUNK_SIZE = 64 * 1024
+
+#: Default maximum size in bytes of the downloaded template cache.
+CACHE_SIZE = 256 * 1024 * 1024
+
+#: Name of the metadata file stored with each template cache entry.
+META = "meta.json"
+
+#: HTTP status returned by conditional requests for unchanged content.
+NOT_MODIFIED = 304
+
+#: Shared session so that connections are kept alive between requests.
+_SESSION = None
+_SESSLOCK = threading.Lock()
+
+##==============================================================#
+## SECTION: Class Definitions                                   #
+##==============================================================#
+
+class SharedTarballs(object):
+    """Downloads each repository tarball at most once into a temporary
+    directory so that several subdirectories can be extracted from it. Safe
+    to share between threads; call `close()` to delete the files."""
+    def __init__(self):
+        self.tmpdir = None
+        self.paths = {}
+        self.locks = {}
+        self.lock = threading.Lock()
+    def extract(self, srcurl, dstdir):
+        """Same as `download_archive()` but uses the shared tarball. Returns
+        true if successful."""
+        arcurl, subdir = prep_archive(srcurl)
+        if not arcurl:
+            return False
+        path = self.get(arcurl)
+        if not path:
+            return False
+        try:
+            with io.open(path, "rb") as fi:
+                return extract_tar(fi, dstdir, subdir)
+        except tarfile.TarError:
+            return False
+    def get(self, arcurl):
+        """Returns the local path of the given tarball URL or None if it could
+        not be downloaded."""
+        with self.lock:
+            if not self.tmpdir:
+                self.tmpdir = tempfile.mkdtemp(prefix="poppage-tar-")
+            lock = self.locks.setdefault(arcurl, threading.Lock())
+        with lock:
+            if arcurl not in self.paths:
+                self.paths[arcurl] = self._fetch(arcurl)
+            return self.paths[arcurl]
+    def _fetch(self, arcurl):
+        path = op.join(self.tmpdir, hashlib.sha1(arcurl.encode("utf-8")).hexdigest())
+        try:
+            with _get(arcurl, stream=True) as resp:
+                if resp.status_code != 200:
+                    return None
+                save_stream(resp, path)
+        except requests.RequestException:
+            return None
+        return path
+    def close(self):
+        if self.tmpdir:
+            fsys.delete(self.tmpdir)
+            self.tmpdir = None
+        self.paths = {}
+
 ##==============================================================#
 ## SECTION: Function Definitions                                #
 ##==============================================================#
 
+def get_session():
+    """Returns the shared `requests.Session` used for all downloads."""
+    global _SESSION
+    with _SESSLOCK:
+        if not _SESSION:
+            _SESSION = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_maxsize=JOBS)
+            _SESSION.mount("http://", adapter)
+            _SESSION.mount("https://", adapter)
+        return _SESSION
+
 def is_github(src):
     if src.startswith(GHAPI):
         return True
@@ -70,6 +166,23 @@ def prep_url(url):
         name = tok[-1]
     return url,name
 
+def prep_archive(url):
+    """Returns the tarball API URL for the repository and ref of the given
+    contents API URL along with the requested subdirectory path. Returns
+    `(None, None)` if the URL is not a contents API URL."""
+    if not url.startswith(GHAPI) or "/contents" not in url:
+        return None, None
+    path, _, query = url[len(GHAPI):].partition("?")
+    repo, _, subdir = path.partition("/contents")
+    ref = ""
+    for param in query.split("&"):
+        if param.startswith("ref="):
+            ref = param[len("ref="):]
+    arcurl = GHAPI + repo + "/tarball"
+    if ref:
+        arcurl += "/" + ref
+    return arcurl, unquote(subdir.strip("/"))
+
 def is_file(url):
     """Checks if the given URL is for a file and returns the filename if so;
     returns None otherwise."""
@@ -82,41 +195,264 @@ def is_dir(url):
         return None
     return unquote(url.split("/")[-1])
 
-def download(srcurl, dstpath=None):
+def download(srcurl, dstpath=None, jobs=JOBS, archive=True, verify=True, tarballs=None):
     """Handles downloading files/dirs from the given GitHub repo URL to the
-    given destination path."""
-    def download_api(srcurl, dstdir):
-        items = requests.get(srcurl).json()
-        if op.isfile(dstdir):
-            raise Exception("DestDirIsFile")
-        fsys.makedirs(dstdir, ignore_extsep=True)
-        if isinstance(items, dict) and "message" in items.keys():
-            qprompt.error(items['message'])
-            return
-        for item in items:
-            if "file" == item['type']:
-                fpath = op.join(dstdir, item['name'])
-                with io.open(fpath, "w", encoding="utf-8") as fo:
-                    text = requests.get(item['download_url']).text
-                    fo.write(text)
-            else:
-                download_api(item['url'], op.join(dstdir, item['name']))
-    def download_raw(srcurl, dstfile):
-        fsys.makedirs(dstfile)
-        if op.isdir(dstfile):
-            dstfile = op.join(dstfile, srcurl.split("/")[-1])
-        dstfile = unquote(dstfile)
-        with io.open(dstfile, "w") as fo:
-            fo.write(requests.get(srcurl).text)
+    given destination path. If `archive` is true, directories are extracted
+    from the repository tarball in a single request, taken from the given
+    `SharedTarballs` if any; otherwise, or if the tarball cannot be used,
+    directory listings and files are fetched concurrently using up to `jobs`
+    connections. If `verify` is true, files fetched individually are checked
+    against the blob SHA of the listing."""
     url,name = prep_url(srcurl)
     if not dstpath:
         dstpath = op.join(op.abspath("."), name)
     dstpath = op.abspath(dstpath)
     if url.startswith(GHAPI):
-        download_api(url, dstpath)
+        if archive and tarballs and tarballs.extract(url, dstpath):
+            return
+        if archive and download_archive(url, dstpath) != None:
+            return
+        download_api(url, dstpath, jobs, verify)
     else:
         download_raw(url, dstpath)
 
+def download_cached(srcurl, cachedir, offline=False, maxsize=CACHE_SIZE, jobs=JOBS):
+    """Downloads the given GitHub repo URL into a persistent cache under the
+    given directory and returns the path of the cached directory containing
+    the file/dir. Cached entries are revalidated with a conditional request
+    (ETag) unless the URL is pinned to a commit SHA. If `offline` is true,
+    only the cache is used. Returns None if the URL could not be
+    downloaded or is not cached when offline. The least recently used
+    entries are removed when the cache grows beyond `maxsize` bytes."""
+    url,_ = prep_url(srcurl)
+    key = hashlib.sha1(url.encode("utf-8")).hexdigest()
+    entry = op.join(cachedir, key)
+    datadir = op.join(entry, "poppage-" + key)
+    meta = _read_meta(entry) if op.isdir(datadir) else None
+    if meta != None and (offline or is_pinned(url)):
+        _touch_meta(entry)
+        return datadir
+    if offline:
+        return None
+    fsys.makedirs(cachedir, ignore_extsep=True)
+    tmpdir = tempfile.mkdtemp(prefix="tmp-", dir=cachedir)
+    try:
+        tmpdata = op.join(tmpdir, op.basename(datadir))
+        etag = (meta or {}).get('etag')
+        if url.startswith(GHAPI):
+            resp = download_archive(url, tmpdata, etag)
+            if resp == None and not download_api(url, tmpdata, jobs):
+                return None
+        else:
+            fsys.makedirs(tmpdata, ignore_extsep=True)
+            resp = download_raw(url, tmpdata, etag)
+            if resp.status_code not in [200, NOT_MODIFIED]:
+                return None
+        if resp != None and NOT_MODIFIED == resp.status_code:
+            _touch_meta(entry)
+            return datadir
+        etag = resp.headers.get("ETag") if resp != None else None
+        _write_meta(tmpdir, {'url': url, 'etag': etag})
+        if op.isdir(entry):
+            fsys.delete(entry)
+        os.rename(tmpdir, entry)
+    finally:
+        if op.isdir(tmpdir):
+            fsys.delete(tmpdir)
+    prune_cache(cachedir, maxsize, keep=entry)
+    return datadir
+
+def is_pinned(url):
+    """Returns true if the given prepped URL refers to a commit SHA rather
+    than a branch or tag; the content of a pinned URL never changes."""
+    if url.startswith(GHRAW):
+        ref = url[len(GHRAW):].split("/")[2:3]
+    else:
+        ref = [p[len("ref="):] for p in url.partition("?")[2].split("&") if p.startswith("ref=")]
+    return bool(ref) and bool(re.match("^[0-9a-f]{40}$", ref[0]))
+
+def prune_cache(cachedir, maxsize=CACHE_SIZE, keep=None):
+    """Removes the least recently used entries from the given template cache
+    directory until it is within the given size in bytes."""
+    entries = []
+    for name in os.listdir(cachedir):
+        entry = op.join(cachedir, name)
+        if name.startswith("tmp-") or not op.isfile(op.join(entry, META)):
+            continue
+        size = 0
+        for r,_,fs in os.walk(entry):
+            size += sum(op.getsize(op.join(r, f)) for f in fs)
+        entries.append((op.getmtime(op.join(entry, META)), size, entry))
+    total = sum(size for _,size,_ in entries)
+    for _,size,entry in sorted(entries):
+        if total <= maxsize:
+            break
+        if entry != keep:
+            fsys.delete(entry)
+            total -= size
+
+def _read_meta(entry):
+    try:
+        with io.open(op.join(entry, META), encoding="utf-8") as fi:
+            return json.load(fi)
+    except (IOError, OSError, ValueError):
+        return None
+
+def _write_meta(entry, meta):
+    with io.open(op.join(entry, META), "w", encoding="utf-8") as fo:
+        fo.write(json.dumps(meta))
+
+def _touch_meta(entry):
+    """Marks the given cache entry as recently used."""
+    try: os.utime(op.join(entry, META), None)
+    except OSError: pass
+
+def _get(url, etag=None, stream=False):
+    """Sends a GET request using the shared session. If an ETag is given, the
+    request is conditional."""
+    headers = {"If-None-Match": etag} if etag else {}
+    return get_session().get(url, headers=headers, stream=stream)
+
+def download_api(srcurl, dstdir, jobs=JOBS, verify=True):
+    """Downloads the directory for the given contents API URL file by file.
+    Directory listings and files are fetched concurrently using up to `jobs`
+    connections. If `verify` is true, each file is checked against the blob
+    SHA given in the listing. Returns false if a directory listing could not
+    be fetched."""
+    def list_api(srcurl):
+        return _get(srcurl).json()
+    def fetch_file(item, fpath):
+        hasher = None
+        if verify and item.get('sha') and item.get('size') != None:
+            hasher = git_blob_hasher(item['size'])
+        with _get(item['download_url'], stream=True) as resp:
+            save_stream(resp, fpath, hasher)
+        if hasher and hasher.hexdigest() != item['sha']:
+            fsys.delete(fpath)
+            raise Exception("ChecksumMismatch: `%s`" % (item['path'] if 'path' in item else fpath))
+    pool = mpool.ThreadPool(jobs)
+    try:
+        # Directories are listed one level at a time; all listings of a level
+        # are requested together while the files found so far are still
+        # downloading.
+        pending = []
+        success = True
+        level = [(srcurl, dstdir)]
+        while level:
+            nextlevel = []
+            listings = pool.map(list_api, [url for url,_ in level])
+            for (_, dstdir), items in zip(level, listings):
+                if op.isfile(dstdir):
+                    raise Exception("DestDirIsFile")
+                fsys.makedirs(dstdir, ignore_extsep=True)
+                if isinstance(items, dict) and "message" in items.keys():
+                    qprompt.error(items['message'])
+                    success = False
+                    continue
+                for item in items:
+                    ipath = op.join(dstdir, item['name'])
+                    if "file" == item['type']:
+                        pending.append(pool.apply_async(fetch_file, (item, ipath)))
+                    else:
+                        nextlevel.append((item['url'], ipath))
+            level = nextlevel
+        for result in pending:
+            result.get()
+        return success
+    finally:
+        pool.close()
+        pool.join()
+
+def download_raw(srcurl, dstfile, etag=None, hasher=None):
+    """Downloads the given raw content URL to the given file path (or into
+    the given directory). The content is streamed to disk and, if given,
+    passed to the `hashlib` style hasher. Returns the response; nothing is
+    written if the response is `304 Not Modified`."""
+    with _get(srcurl, etag, stream=True) as resp:
+        if NOT_MODIFIED == resp.status_code:
+            return resp
+        fsys.makedirs(dstfile)
+        if op.isdir(dstfile):
+            dstfile = op.join(dstfile, srcurl.split("/")[-1])
+        save_stream(resp, unquote(dstfile), hasher)
+    return resp
+
+def save_stream(resp, fpath, hasher=None):
+    """Writes the body of the given streamed response to the given file in
+    chunks of `CHUNK_SIZE` bytes. The content is not decoded so binary files
+    are kept intact. Each chunk is also passed to the hasher if given."""
+    with io.open(fpath, "wb") as fo:
+        for chunk in resp.iter_content(CHUNK_SIZE):
+            if hasher:
+                hasher.update(chunk)
+            fo.write(chunk)
+
+def git_blob_hasher(size):
+    """Returns a SHA-1 hasher primed with the Git blob header for content of
+    the given size; its digest matches the `sha` of GitHub contents API
+    items."""
+    return hashlib.sha1(("blob %u\0" % (size)).encode("ascii"))
+
+def download_archive(srcurl, dstdir, etag=None):
+    """Downloads the directory for the given contents API URL by streaming the
+    repository tarball and extracting only the requested subdirectory into
+    the given destination directory. Returns the response if successful
+    (nothing is extracted if it is `304 Not Modified`) or None if the tarball
+    could not be used."""
+    arcurl, subdir = prep_archive(srcurl)
+    if not arcurl:
+        return None
+    if op.isfile(dstdir):
+        raise Exception("DestDirIsFile")
+    try:
+        resp = _get(arcurl, etag, stream=True)
+    except requests.RequestException:
+        return None
+    with resp:
+        if NOT_MODIFIED == resp.status_code:
+            return resp
+        if resp.status_code != 200:
+            return None
+        resp.raw.decode_content = True
+        try:
+            if extract_tar(resp.raw, dstdir, subdir):
+                return resp
+        except tarfile.TarError:
+            pass
+    return None
+
+def extract_tar(fileobj, dstdir, subdir=""):
+    """Extracts the given subdirectory of a GitHub tarball stream into the
+    given destination directory. Members are read in a single pass so the
+    tarball is never fully held in memory. Returns true if the subdirectory
+    was found."""
+    found = False
+    prefix = subdir.strip("/") + "/" if subdir else ""
+    with tarfile.open(fileobj=fileobj, mode="r|gz") as tar:
+        for member in tar:
+            # Skip the top-level `owner-repo-sha` directory of the tarball.
+            relpath = member.name.partition("/")[2]
+            if prefix:
+                if relpath + "/" == prefix:
+                    found = True
+                if not relpath.startswith(prefix):
+                    continue
+                relpath = relpath[len(prefix):]
+            relpath = relpath.strip("/")
+            if not relpath or ".." in relpath.split("/"):
+                continue
+            found = True
+            target = op.join(dstdir, *relpath.split("/"))
+            if member.isdir():
+                fsys.makedirs(target, ignore_extsep=True)
+            elif member.isfile():
+                fsys.makedirs(op.dirname(target), ignore_extsep=True)
+                with io.open(target, "wb") as fo:
+                    shutil.copyfileobj(tar.extractfile(member), fo)
+    if found or not prefix:
+        fsys.makedirs(dstdir, ignore_extsep=True)
+    return found or not prefix
+
 ##==============================================================#
 ## SECTION: Main Body                                           #
 ##==============================================================#
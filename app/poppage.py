@@ -6,6 +6,8 @@ Usage:
     poppage check [options]
     poppage run [options] [(--string KEY VAL) | (--file KEY PATH)]...
     poppage debug [options] [(--string KEY VAL) | (--file KEY PATH)]...
+    poppage batch [options] [(--string KEY VAL) | (--file KEY PATH)]...
+    poppage serve [--socket SOCKET]
     poppage -h | --help
     poppage --version
 
@@ -14,6 +16,11 @@ Commands:
     make    Generates directories and files based on the given INPATH template.
     run     Generates the OUTPATH, executes commands, then deletes OUTPATH.
     debug   Shows the state of the utility and template data structures.
+    batch   Generates the INPATH template once for every template dictionary
+            in CONTEXTS.
+    serve   Runs a daemon that handles forwarded make, check and batch calls
+            and render requests over a Unix socket while keeping caches
+            warm.
 
 Options:
     --inpath INPATH         Input Jinja2 template used to generate the output;
@@ -23,12 +30,43 @@ Options:
                             directory based on the input template.
     --execute EXECUTE       Commands to execute after rendering template. Only
                             applies to run command.
+    --contexts CONTEXTS     Stream of template dictionaries for the batch
+                            command; either a JSON Lines file, a multi-document
+                            YAML file, or `-` to read JSON Lines from stdin.
     --string KEY VAL        Use the given string VAL for the given template
                             variable KEY.
     --file KEY PATH         Use the given file contents in PATH for the given
                             template variable KEY.
     --keysep KEYSEP         Delimiter to use for separating nested KEYs.
                             [default: ::]
+    --no-check              Skip checking templates for variables that were
+                            not supplied values.
+    --jobs JOBS             Number of files to generate concurrently; use 0 for
+                            one job per CPU. Also limits how many make
+                            targets are generated at once when several are
+                            given, and how many commands of a `&` group in
+                            EXECUTE run at once. [default: 1]
+    --processes             Use worker processes rather than threads for JOBS;
+                            useful for CPU heavy templates.
+    --incremental           Keep a manifest next to the output and skip
+                            outputs that have not changed since the last make.
+    --no-cache              Do not use the on-disk template bytecode cache
+                            or the downloaded template cache.
+    --offline               Only use remote templates that are already in the
+                            downloaded template cache; implies caching.
+    --lazy                  Only read `!file`, `!cmd`, `!ask` and `--file`
+                            values that the template uses.
+    --link-binaries         Hardlink binary files from the template into the
+                            output rather than copying them; falls back to a
+                            symlink if a hardlink is not possible. Note that
+                            changing a linked output also changes the template.
+    --scratch DIR           Directory in which the run command creates its
+                            temporary output when no OUTPATH is given (e.g.
+                            the RAM-backed `/dev/shm`); defaults to the
+                            current directory.
+    --socket SOCKET         Path of the Unix socket for the serve command;
+                            defaults to `$POPPAGE_SOCKET` or a path in the
+                            poppage cache directory.
     -h --help               Show this help message and exit.
     --version               Show version and exit.
 
@@ -39,11 +77,34 @@ Notes:
   - The output will be passed to `stdout` if INPATH is a file (rather than a
     directory) and INPATH does not contain a template variable and no OUTPATH
     is specified.
+  - For the batch command, each template dictionary in CONTEXTS is applied on
+    top of the defaults and CLI key/values. OUTPATH is rendered for every
+    dictionary so it should usually contain template variables (e.g.
+    `out/{{name}}/`).
   - In a YAML defaults file, use a `command` key under `__opt__` to specify the
     default command.
+  - When make is given several INPATH/OUTPATH pairs (e.g. lists under
+    `__opt__`), up to JOBS targets are generated concurrently, remote
+    templates are downloaded once per run and the result of every target is
+    reported; the exit code is nonzero if any target failed.
+  - Each line of EXECUTE is a command. Consecutive lines starting with `&`
+    form a group whose commands run concurrently (up to JOBS at a time if
+    JOBS is more than 1) with their output shown once each finishes; other
+    lines run one at a time. Exit codes and timings are reported at the end.
+  - The run command always deletes OUTPATH afterwards, including when a
+    command fails, the run is interrupted or the process receives SIGTERM.
   - When running using INPATH as first argument, additional arguments will be
     passed to the execute commands as RUNARGS. In this scenario, INPATH will
     typically be a YAML defaults file with an `__opt__` key.
+  - Set the `POPPAGE_CACHE` environment variable to `1` to cache compiled
+    templates on disk under `$XDG_CACHE_HOME/poppage` between invocations.
+    Templates downloaded from GitHub are also cached and only downloaded
+    again when they have changed (unless pinned to a commit SHA).
+  - When the `POPPAGE_SOCKET` environment variable is set and a serve daemon
+    is listening on that socket, make, check and batch calls are forwarded to
+    the daemon and run in the current directory with the current environment.
+    Calls that read from stdin are never forwarded; calls that need to prompt
+    (e.g. `!ask`) are handed back by the daemon and run locally.
 """
 
 ##==============================================================#
@@ -51,26 +112,47 @@ Notes:
 ##==============================================================#
 
 import collections
+import contextlib
+import fnmatch
+import functools
+import hashlib
 import io
+import json
 import os
 import os.path as op
 import random
+import shutil
+import signal
+import socket
+import subprocess
 import sys
 import tempfile
+import threading
+import time
+import traceback
 from string import ascii_lowercase
-from pprint import pprint
 
-import auxly.filesys as fsys
-import auxly.shell as sh
-import qprompt
-from binaryornot.check import is_binary
 from docopt import docopt
-from jinja2 import FileSystemLoader, Template, Undefined, meta
+from jinja2 import FileSystemBytecodeCache, FileSystemLoader, Template, Undefined, meta
 from jinja2.environment import Environment
-from jinja2schema import infer, model
 
 import gitr
 import utilconf
+from utilconf import LazyModule
+
+# Dependencies that are only needed by some code paths are imported on first
+# use to keep startup fast (e.g. `requests` is only used for GitHub inputs and
+# `jinja2schema` only when checking templates).
+binaryornot = LazyModule("binaryornot.helpers")
+fsys = LazyModule("auxly.filesys")
+jinja2schema = LazyModule("jinja2schema")
+mpool = LazyModule("multiprocessing.pool")
+multiprocessing = LazyModule("multiprocessing")
+pprint = LazyModule("pprint")
+qprompt = LazyModule("qprompt")
+sh = LazyModule("auxly.shell")
+socketserver = LazyModule("socketserver" if sys.version_info >= (3, 0) else "SocketServer")
+yaml = LazyModule("yaml")
 
 ##==============================================================#
 ## SECTION: Setup                                               #
@@ -91,10 +173,67 @@ __version__ = "0.8.1"
 #: Key separator.
 KEYSEP = "::"
 
+#: Maximum number of compiled templates kept in the template cache.
+CACHE_SIZE = 1024
+
+#: Maximum number of template directories with their own Jinja2 environment
+#: kept by a renderer.
+ENV_CACHE_SIZE = 64
+
+#: Maximum size in bytes of the on-disk bytecode cache.
+BYTECODE_CACHE_SIZE = 64 * 1024 * 1024
+
+#: Buffer size in bytes used when streaming rendered output to a file.
+STREAM_BUFSIZE = 64 * 1024
+
+#: Number of leading bytes of a file checked when classifying its contents.
+CLASSIFY_SIZE = 1024
+
+#: Files up to this size in bytes are read whole when classified and their
+#: text kept for the template loader; larger files only have a prefix read.
+SOURCE_CACHE_SIZE = 1024 * 1024
+
+#: Linux `ioctl` request used to reflink (clone) a file.
+FICLONE = 0x40049409
+
+#: Name of the optional file in a template directory that maps file name
+#: patterns to `text` or `binary`.
+TYPEMAP = ".poppage"
+
+#: File extensions that are always treated as text templates.
+TEXT_EXTS = set("""
+    .adoc .bat .c .cfg .cmake .cpp .cs .css .csv .go .h .hpp .htm .html .ini
+    .j2 .java .jinja .jinja2 .js .json .jsx .md .php .pl .ps1 .py .rb .rs .rst
+    .sh .sql .svg .tex .tmpl .toml .ts .tsx .txt .xml .yaml .yml
+    """.split())
+
+#: File extensions that are always treated as binary files.
+BINARY_EXTS = set("""
+    .7z .a .avi .bin .bmp .bz2 .class .db .dll .dylib .eot .exe .flac .gif
+    .gz .ico .iso .jar .jpeg .jpg .mov .mp3 .mp4 .o .obj .ogg .otf .pdf .png
+    .psd .pyc .so .sqlite .tar .tgz .tif .tiff .ttf .wav .webm .webp .whl
+    .woff .woff2 .xz .zip
+    """.split())
+
+#: Name of the manifest file used by incremental make.
+MANIFEST = ".poppage-manifest.json"
+
 ##==============================================================#
 ## SECTION: Class Definitions                                   #
 ##==============================================================#
 
+class TemplateReadError(Exception):
+    """Raised when a template file cannot be decoded."""
+
+class TemplateLoader(FileSystemLoader):
+    """Loads templates included by a template file from its directory. Falls
+    back to the `mbcs` encoding if a template is not valid UTF-8."""
+    def get_source(self, environment, template):
+        try:
+            return FileSystemLoader.get_source(self, environment, template)
+        except UnicodeDecodeError:
+            return FileSystemLoader(self.searchpath, encoding="mbcs").get_source(environment, template)
+
 class SkipUndefined(Undefined):
     def _fail_with_undefined_error(self, *args, **kwargs):
         return None
@@ -103,6 +242,326 @@ class SkipUndefined(Undefined):
     def __getattr__(self, key):
         return self
 
+class TemplateCache(object):
+    """Thread-safe LRU cache of compiled templates or template analysis
+    results. Tracks cache hits and misses."""
+    def __init__(self, maxsize=CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+    def __len__(self):
+        return len(self._items)
+    def get(self, key, create):
+        """Returns the cached item for the given key. If the key is not
+        cached, the item is created by calling `create()`."""
+        with self._lock:
+            if key in self._items:
+                self.hits += 1
+                item = self._items.pop(key)
+                self._items[key] = item
+                return item
+            self.misses += 1
+        item = create()
+        with self._lock:
+            self._items[key] = item
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+        return item
+    def peek(self, key, default=None):
+        """Returns the cached item for the given key or the default without
+        creating it, updating its recent use or counting a hit or miss."""
+        with self._lock:
+            return self._items.get(key, default)
+    def pop(self, key, default=None):
+        """Removes and returns the cached item for the given key or returns
+        the default if the key is not cached."""
+        with self._lock:
+            if key in self._items:
+                self.hits += 1
+                return self._items.pop(key)
+            self.misses += 1
+            return default
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.hits = 0
+            self.misses = 0
+    def info(self):
+        """Returns a dictionary of cache statistics."""
+        return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._items),
+                'maxsize': self.maxsize}
+
+class BytecodeCache(FileSystemBytecodeCache):
+    """On-disk Jinja2 bytecode cache shared by all poppage environments. The
+    least recently used entries are removed when the cache grows beyond
+    `maxsize` bytes."""
+    def __init__(self, directory, maxsize=BYTECODE_CACHE_SIZE):
+        fsys.makedirs(directory, ignore_extsep=True)
+        FileSystemBytecodeCache.__init__(self, directory)
+        self.maxsize = maxsize
+        self._size = None
+    def load_bytecode(self, bucket):
+        FileSystemBytecodeCache.load_bytecode(self, bucket)
+        if bucket.code is not None:
+            # Touch the entry so that eviction is least recently used.
+            try: os.utime(self._get_cache_filename(bucket), None)
+            except OSError: pass
+    def dump_bytecode(self, bucket):
+        FileSystemBytecodeCache.dump_bytecode(self, bucket)
+        try: size = os.path.getsize(self._get_cache_filename(bucket))
+        except OSError: return
+        if self._size == None:
+            self._size = sum(os.path.getsize(p) for _,p in self._entries())
+        else:
+            self._size += size
+        if self._size > self.maxsize:
+            self.prune()
+    def _entries(self):
+        prefix, suffix = self.pattern.split("%s")
+        for name in os.listdir(self.directory):
+            if name.startswith(prefix) and name.endswith(suffix):
+                path = op.join(self.directory, name)
+                yield os.stat(path).st_mtime, path
+    def prune(self):
+        """Removes the least recently used entries until the cache is within
+        its size limit."""
+        entries = sorted(self._entries())
+        self._size = sum(os.path.getsize(p) for _,p in entries)
+        for _,path in entries:
+            if self._size <= self.maxsize:
+                break
+            try:
+                self._size -= os.path.getsize(path)
+                os.remove(path)
+            except OSError:
+                pass
+
+class Manifest(object):
+    """Records the source, context and output hashes of generated files so
+    that unchanged outputs can be skipped by incremental make. Entries are
+    keyed by output path relative to the manifest directory."""
+    def __init__(self, dirpath, entries=None):
+        self.dirpath = op.abspath(dirpath)
+        self.path = op.join(self.dirpath, MANIFEST)
+        self.entries = entries if entries != None else self._load()
+        self.changes = {}
+        self.stats = collections.Counter()
+    def _load(self):
+        try:
+            with io.open(self.path, encoding="utf-8") as fi:
+                return json.load(fi)
+        except (IOError, OSError, ValueError):
+            return {}
+    def _key(self, outpath):
+        return op.relpath(op.abspath(outpath), self.dirpath)
+    def fork(self):
+        """Returns a manifest sharing this manifest's entries but with its own
+        changes and stats; used by make_dir() workers."""
+        return Manifest(self.dirpath, self.entries)
+    def merge(self, changes, stats):
+        self.changes.update(changes)
+        self.stats.update(stats)
+    def unchanged(self, outpath, source, context):
+        """Returns true if the given output was generated from the same source
+        and context and has not been modified since. Outputs without a known
+        source are never unchanged."""
+        if source is None:
+            return False
+        entry = self.changes.get(self._key(outpath)) or self.entries.get(self._key(outpath))
+        if not entry or [entry['source'], entry['context']] != [source, context]:
+            return False
+        return op.isfile(outpath) and _hash_file(outpath) == entry['output']
+    def record(self, outpath, source, context, output):
+        self.changes[self._key(outpath)] = {
+                'source': source,
+                'context': context,
+                'output': output}
+    def save(self):
+        """Merges the changes into the manifest file, which is re-read first
+        since other targets may have saved to it, and replaced atomically."""
+        if not self.changes:
+            return
+        with _MANIFESTLOCK:
+            self.entries.update(self._load())
+            self.entries.update(self.changes)
+            self.changes = {}
+            fsys.makedirs(self.dirpath, ignore_extsep=True)
+            tmppath = "%s.__temp-poppage-%s" % (self.path, _getrands(6))
+            try:
+                with io.open(tmppath, "w", encoding="utf-8") as fo:
+                    fo.write(json.dumps(self.entries, indent=2, sort_keys=True))
+                _replace(tmppath, self.path)
+            finally:
+                if op.exists(tmppath):
+                    os.remove(tmppath)
+    def summary(self):
+        return "%u skipped, %u rendered, %u written" % (
+                self.stats['skipped'],
+                self.stats['rendered'],
+                self.stats['written'])
+
+class Renderer(object):
+    """Renders template strings, files and directories to return values or
+    file objects without printing, so poppage can be embedded in other
+    applications. A renderer owns its Jinja2 environments, compiled template
+    cache and settings; a single instance is thread-safe and can be shared
+    by concurrent requests.
+
+    **Params**:
+      - keysep (str) - Separator used when naming missing nested variables;
+        defaults to `KEYSEP` at render time.
+      - undefined (class) - Jinja2 undefined type (e.g.
+        `jinja2.StrictUndefined`); missing variables render empty by default.
+      - checkvars (bool) - If true, templates are checked for missing
+        variables, which are reported through `warn`.
+      - warn (func) - Called with a message about missing variables; the
+        check is skipped if not given.
+      - bytecode_cache (BytecodeCache) - Optional on-disk bytecode cache.
+      - cachesize (int) - Maximum number of cached compiled templates.
+    """
+    def __init__(self, keysep=None, undefined=SkipUndefined, checkvars=True, warn=None, bytecode_cache=None, cachesize=CACHE_SIZE):
+        self.keysep = keysep
+        self.undefined = undefined
+        self.checkvars = checkvars
+        self.warn = warn
+        self.tmplcache = TemplateCache(cachesize)
+        self._bcc = bytecode_cache
+        self._envs = {}
+        self._overlays = TemplateCache(ENV_CACHE_SIZE)
+        self._envlock = threading.Lock()
+    def get_env(self, kind="str", dirpath=None):
+        """Returns the Jinja2 environment for rendering template strings
+        (`str`) or template files (`file`), created on first use. If a
+        directory is given, the returned file environment loads templates
+        used by `include`, `extends` and `import` from it; the environments
+        of the least recently used directories are dropped."""
+        if dirpath:
+            env = self.get_env("file")
+            return self._overlays.get(dirpath, lambda: env.overlay(loader=TemplateLoader(dirpath)))
+        with self._envlock:
+            if kind not in self._envs:
+                env = Environment(undefined=self.undefined, extensions=['jinja2_time.TimeExtension'])
+                env.trim_blocks = True
+                env.lstrip_blocks = True
+                env.keep_trailing_newline = ("file" == kind)
+                env.bytecode_cache = self._bcc if "file" == kind else None
+                self._envs[kind] = env
+            return self._envs[kind]
+    def set_bytecode_cache(self, bcc):
+        with self._envlock:
+            self._bcc = bcc
+            for key, env in self._envs.items():
+                if "str" != key:
+                    env.bytecode_cache = bcc
+            # Directory environments are recreated from the file environment.
+            self._overlays.clear()
+    def get_tmpl_str(self, tmplstr):
+        """Returns the compiled template for the given template string."""
+        env = self.get_env("str")
+        return self.tmplcache.get(("str", tmplstr), lambda: _compile(env, tmplstr))
+    def get_tmpl_file(self, tmplpath):
+        """Returns the compiled template and the template text for the given
+        template file path. Cached templates are reused until the file
+        changes."""
+        def create():
+            tmplstr = _read_tmpl(tmplpath, self._warn, keep=False)
+            tmpl = _compile(env, tmplstr, op.basename(tmplpath), tmplpath, kind="file")
+            return tmpl, tmplstr
+        env = self.get_env("file", op.dirname(op.abspath(tmplpath)))
+        return self.tmplcache.get(("file",) + _filekey(tmplpath), create)
+    def missing(self, tmplstr, tmpldict):
+        """Returns the variables of the given template string that are not in
+        the given template dictionary."""
+        return check_template(tmplstr, tmpldict, self.keysep, self._warn)
+    def _warn(self, msg):
+        if self.warn:
+            self.warn(msg)
+    def _check(self, tmplstr, tmpldict, checkvars, name=None):
+        if not self.warn or not (self.checkvars if checkvars is None else checkvars):
+            return
+        miss = self.missing(tmplstr, tmpldict)
+        if miss and name:
+            self.warn("Template vars `%s` in `%s` were not supplied values!" % ("/".join(miss), name))
+        elif miss:
+            self.warn("Template vars `%s` were not supplied values!" % ("/".join(miss)))
+    def render_str(self, tmplstr, tmpldict, checkvars=None):
+        """Returns the given template string rendered with the given template
+        dictionary."""
+        self._check(tmplstr, tmpldict, checkvars)
+        return self.get_tmpl_str(tmplstr).render(**tmpldict)
+    def render_file(self, tmplpath, tmpldict, checkvars=None, fo=None):
+        """Returns the given template file rendered with the given template
+        dictionary. If a file object is given, the output is streamed to it
+        instead and the file object is returned."""
+        if fo is None:
+            return self._load_file(tmplpath, tmpldict, checkvars).render(**tmpldict)
+        _write_chunks(self.stream_file(tmplpath, tmpldict, checkvars), fo)
+        return fo
+    def stream_file(self, tmplpath, tmpldict, checkvars=None):
+        """Same as `render_file()` but returns an iterator over chunks of the
+        rendered text."""
+        return self._load_file(tmplpath, tmpldict, checkvars).generate(**tmpldict)
+    def _load_file(self, tmplpath, tmpldict, checkvars):
+        tmplpath = op.abspath(tmplpath)
+        tmpl, tmplstr = self.get_tmpl_file(tmplpath)
+        self._check(tmplstr, tmpldict, checkvars, op.basename(tmplpath))
+        return tmpl
+    def render_tree(self, inpath, tmpldict, checkvars=None):
+        """Renders the given template directory in memory. Returns an ordered
+        dictionary mapping the rendered path of every file, relative to the
+        directory and using `/` separators, to the rendered text (or the
+        content bytes for binary files)."""
+        inpath = op.abspath(inpath)
+        tree = collections.OrderedDict()
+        for r,ds,fs in os.walk(inpath):
+            ds.sort()
+            for f in sorted(fs):
+                if TYPEMAP == f:
+                    continue
+                path = op.join(r, f)
+                relpath = op.relpath(path, inpath).replace(os.sep, "/")
+                outrel = self.render_str(relpath, tmpldict, checkvars)
+                if "binary" == classify(path, inpath):
+                    with io.open(path, "rb") as fi:
+                        tree[outrel] = fi.read()
+                else:
+                    tree[outrel] = self.render_file(path, tmpldict, checkvars)
+        return tree
+
+class SharedDownloads(object):
+    """Remote templates downloaded for a run that generates several targets.
+    Each template URL is downloaded once, and each repository tarball at most
+    once, no matter how many targets use it. Safe to share between threads;
+    call `close()` to delete the downloads."""
+    def __init__(self):
+        self.tarballs = gitr.SharedTarballs()
+        self.paths = {}
+        self.to_delete = []
+        self._locks = {}
+        self._lock = threading.Lock()
+    def get(self, inpath):
+        """Returns the local directory holding the given remote template."""
+        with self._lock:
+            lock = self._locks.setdefault(inpath, threading.Lock())
+        with lock:
+            if inpath not in self.paths:
+                tpath, to_delete = _fetch_template(inpath, self.tarballs)
+                if to_delete:
+                    self.to_delete.append(to_delete)
+                self.paths[inpath] = tpath
+            return self.paths[inpath]
+    def close(self):
+        for path in self.to_delete:
+            fsys.delete(path)
+        self.to_delete = []
+        self.paths = {}
+        self.tarballs.close()
+
 ##==============================================================#
 ## SECTION: Function Definitions                                #
 ##==============================================================#
@@ -110,12 +569,202 @@ class SkipUndefined(Undefined):
 #: Random uppercase string of length x.
 _getrands = lambda x: "".join(random.choice(ascii_lowercase) for _ in range(x))
 
+#: Renderer used by the module level functions; missing variables are
+#: reported with `qprompt`.
+_RENDERER = Renderer(warn=lambda msg: qprompt.warn(msg))
+
+#: Process-wide cache of compiled templates.
+_TMPLCACHE = _RENDERER.tmplcache
+
+#: Process-wide cache of inferred template variables keyed by content hash.
+_INFERCACHE = TemplateCache()
+
+#: Cache of text read while classifying files, handed to the template loader
+#: so each file only needs to be read once.
+_SRCCACHE = TemplateCache(maxsize=256)
+
+#: Cache of file classifications keyed by path and mtime.
+_TYPECACHE = TemplateCache(maxsize=16384)
+
+#: Thread-local state, used to detect make_dir() workers.
+_LOCAL = threading.local()
+
+#: Serializes lines written by workers.
+_ECHOLOCK = threading.Lock()
+
+#: Serializes manifest saves so concurrent targets sharing a manifest file
+#: do not drop each other's entries.
+_MANIFESTLOCK = threading.Lock()
+
+#: On-disk bytecode cache shared by all environments; None if disabled.
+_BCC = None
+
+#: True while handling calls forwarded to a serve daemon.
+_SERVING = False
+
+#: Settings of the downloaded template cache; None if disabled.
+_DLCACHE = None
+
+def get_env(kind="str"):
+    """Returns the shared Jinja2 environment for rendering template strings
+    (`str`) or template files (`file`). The environment is only created once
+    per process."""
+    return _RENDERER.get_env(kind)
+
+def use_bytecode_cache(enabled=True, directory=None, maxsize=BYTECODE_CACHE_SIZE):
+    """Enables or disables the on-disk bytecode cache for all environments.
+    The cache is stored under the poppage cache directory unless another
+    directory is given."""
+    global _BCC
+    _BCC = None
+    if enabled:
+        _BCC = BytecodeCache(directory or utilconf.get_cachedir("bytecode"), maxsize)
+    _RENDERER.set_bytecode_cache(_BCC)
+
+def use_template_cache(enabled=True, directory=None, offline=False):
+    """Enables or disables the persistent cache of templates downloaded from
+    GitHub. If `offline` is true, remote templates are only taken from the
+    cache."""
+    global _DLCACHE
+    _DLCACHE = None
+    if enabled:
+        _DLCACHE = {
+                'dir': directory or utilconf.get_cachedir("templates"),
+                'offline': offline}
+
+def _compile(env, source, name=None, filename=None, kind="str"):
+    """Returns a template compiled from the given source. Template files use
+    the bytecode cache of the environment if one is set; template strings
+    (often one-off output paths) are never cached on disk."""
+    bcc = env.bytecode_cache if "file" == kind else None
+    if bcc is None:
+        code = env.compile(source, name, filename)
+    else:
+        key = "%s:%s" % (kind, filename or name)
+        bucket = bcc.get_bucket(env, key, filename, source)
+        code = bucket.code
+        if code is None:
+            code = env.compile(source, name, filename)
+            bucket.code = code
+            bcc.set_bucket(bucket)
+    return env.template_class.from_code(env, code, env.make_globals(None))
+
+def cache_info():
+    """Returns hit/miss statistics for the compiled template cache."""
+    return _TMPLCACHE.info()
+
+def _filekey(path):
+    """Returns a key for the given file that changes when the file does."""
+    stat = os.stat(path)
+    return (path, stat.st_mtime, stat.st_size)
+
+def _read_tmpl(tmplpath, warn=None, keep=True):
+    """Returns the text of the template file at the given path. Text kept by
+    classify() is used if available and dropped unless `keep` is true.
+    Decoding issues are passed to `warn` (`qprompt.warn()` by default);
+    raises `TemplateReadError` if the file cannot be decoded."""
+    warn = warn or qprompt.warn
+    key = _filekey(op.abspath(tmplpath))
+    tmplstr = _SRCCACHE.peek(key) if keep else _SRCCACHE.pop(key)
+    if tmplstr != None:
+        return tmplstr
+    for encoding in ["utf-8", "mbcs"]:
+        try:
+            with io.open(tmplpath, encoding=encoding) as fi:
+                return fi.read()
+        except UnicodeDecodeError:
+            warn("Issue while decoding template with `%s`!" % encoding)
+        except LookupError:
+            continue
+    raise TemplateReadError("Unknown issue while loading template `%s`!" % (tmplpath))
+
+def get_tmpl_str(tmplstr):
+    """Returns the compiled template for the given template string."""
+    return _RENDERER.get_tmpl_str(tmplstr)
+
+def get_tmpl_file(tmplpath):
+    """Returns the compiled template and the template text for the given
+    template file path. Cached templates are reused until the file changes."""
+    return _RENDERER.get_tmpl_file(tmplpath)
+
+def classify(path, root=None):
+    """Returns `binary` or `text` for the file at the given path. A `.poppage`
+    type map in the file's directory (or a parent directory up to the given
+    template root directory) takes priority, then known file extensions, then
+    the first `CLASSIFY_SIZE` bytes of the file. Empty files are text. The
+    text of files up to `SOURCE_CACHE_SIZE` bytes is kept for the template
+    loader. Results are cached per path and mtime."""
+    def create():
+        kind = _typemap_kind(path, root)
+        if kind:
+            return kind
+        ext = op.splitext(path)[1].lower()
+        if ext in BINARY_EXTS:
+            return "binary"
+        if ext in TEXT_EXTS:
+            return "text"
+        if not key[2]:
+            return "text"
+        whole = key[2] <= SOURCE_CACHE_SIZE
+        with io.open(path, "rb") as fi:
+            data = fi.read() if whole else fi.read(CLASSIFY_SIZE)
+        if binaryornot.is_binary_string(data[:CLASSIFY_SIZE]):
+            return "binary"
+        if whole:
+            try:
+                text = data.decode("utf-8").replace("\r\n", "\n").replace("\r", "\n")
+                _SRCCACHE.get(key, lambda: text)
+            except UnicodeDecodeError:
+                pass
+        return "text"
+    path = op.abspath(path)
+    root = op.abspath(root) if root else op.dirname(path)
+    key = _filekey(path)
+    return _TYPECACHE.get(key + (root,), create)
+
+def _typemap_kind(path, root):
+    """Returns the kind given to the file at the given path by the nearest
+    `.poppage` type map, looking no further up than the given root
+    directory, or None if no pattern matches."""
+    dirpath = op.dirname(path)
+    while True:
+        mapping = _load_typemap(op.join(dirpath, TYPEMAP))
+        if mapping:
+            relpath = op.relpath(path, dirpath).replace(os.sep, "/")
+            for kind in ["binary", "text"]:
+                for pattern in mapping.get(kind) or []:
+                    if fnmatch.fnmatch(relpath, pattern) or fnmatch.fnmatch(op.basename(path), pattern):
+                        return kind
+            return None
+        parent = op.dirname(dirpath)
+        if parent == dirpath or not _is_within(parent, root):
+            return None
+        dirpath = parent
+
+def _is_within(path, root):
+    """Returns true if the given path is the given root directory or inside
+    it."""
+    return path == root or path.startswith(root.rstrip(os.sep) + os.sep)
+
+def _load_typemap(path):
+    """Returns the type map in the given `.poppage` file or None if the file
+    does not exist. The file is YAML with `text` and/or `binary` keys, each a
+    list of file name patterns (e.g. `binary: [assets/*, "*.dat"]`)."""
+    if not op.isfile(path):
+        return None
+    def create():
+        with io.open(path, encoding="utf-8") as fi:
+            return yaml.safe_load(fi) or {}
+    return _TYPECACHE.get(("typemap",) + _filekey(path), create)
+
 def handle_paths(**dkwargs):
     def wrap(func):
-        def handler(inpath, outpath):
+        def handler(inpath, outpath, downloads):
             if gitr.is_github(inpath):
-                tpath = tempfile.mkdtemp(prefix="poppage-")
-                gitr.download(inpath, tpath)
+                if downloads:
+                    tpath, to_delete = downloads.get(inpath), None
+                else:
+                    tpath, to_delete = _fetch_template(inpath)
                 fname = gitr.is_file(inpath)
                 dname = gitr.is_dir(inpath)
                 if outpath == None:
@@ -125,10 +774,11 @@ def handle_paths(**dkwargs):
                 if dname:
                     outpath = op.join(outpath, op.basename(dname))
                 if fname:
-                    return op.join(tpath, op.basename(fname)), outpath, tpath
-                return tpath, outpath, tpath
-            return inpath, outpath, None
+                    return op.join(tpath, op.basename(fname)), outpath, tpath, to_delete
+                return tpath, outpath, tpath, to_delete
+            return inpath, outpath, None, None
         def inner(*fargs, **fkwargs):
+            downloads = fkwargs.pop('downloads', None)
             inpath = fkwargs.get('inpath') or (
                     fargs[dkwargs['inpath']] if (
                         'inpath' in dkwargs.keys() and dkwargs['inpath'] < len(fargs))
@@ -137,7 +787,7 @@ def handle_paths(**dkwargs):
                     fargs[dkwargs['outpath']] if (
                         'outpath' in dkwargs.keys() and dkwargs['outpath'] < len(fargs))
                     else None)
-            inpath, outpath, to_delete = handler(inpath, outpath)
+            inpath, outpath, tpath, to_delete = handler(inpath, outpath, downloads)
             fargs = list(fargs)
             # The following tries to intelligently handle function arguments so
             # that this decorator can be generalized. Need to handle conditions
@@ -152,127 +802,378 @@ def handle_paths(**dkwargs):
                         fargs[dkwargs[key]] = var
                     else:
                         fkwargs[key] = var
-            if to_delete:
+            if tpath and fkwargs.get('linkbins'):
+                if to_delete or (downloads and tpath in downloads.to_delete):
+                    # Symlinks into a temporary download would dangle once
+                    # it is deleted.
+                    fkwargs['linkbins'] = "hard"
+            if tpath:
                 if op.isdir(inpath):
-                    # If using a temporary directory to hold the template (e.g.
+                    # If using a separate directory to hold the template (e.g.
                     # downloaded from Github), don't include that directory
                     # name in the output paths.
-                    fkwargs['pathsubs'] = [[op.basename(to_delete), "."]]
-            retval = func(*fargs, **fkwargs)
-            if to_delete:
-                fsys.delete(to_delete)
-            return retval
+                    fkwargs['pathsubs'] = [[op.basename(tpath), "."]]
+            try:
+                return func(*fargs, **fkwargs)
+            finally:
+                if to_delete:
+                    fsys.delete(to_delete)
         return inner
     return wrap
 
-def check_template(tmplstr, tmpldict=None):
+def _fetch_template(inpath, tarballs=None):
+    """Gets the given remote template, using the downloaded template cache if
+    enabled. Returns the local directory holding it along with the path to
+    delete once done (None if nothing needs deleting)."""
+    if _DLCACHE:
+        tpath = gitr.download_cached(inpath, _DLCACHE['dir'], offline=_DLCACHE['offline'])
+        if not tpath:
+            qprompt.fatal("Could not get remote template `%s`%s!" % (
+                inpath, " from cache" if _DLCACHE['offline'] else ""))
+        return tpath, None
+    tpath = tempfile.mkdtemp(prefix="poppage-")
+    gitr.download(inpath, tpath, tarballs=tarballs)
+    return tpath, tpath
+
+def infer_vars(tmplstr):
+    """Returns the inferred variable model for the given template string or
+    None if the template could not be analyzed. Results are cached by the
+    content hash of the template string."""
+    def create():
+        try:
+            return jinja2schema.infer(tmplstr)
+        except:
+            return None
+    key = hashlib.sha1(tmplstr.encode("utf-8")).hexdigest()
+    return _INFERCACHE.get(key, create)
+
+def check_template(tmplstr, tmpldict=None, keysep=None, warn=None):
     """Checks the given template string against the given template variable
     dictionary. Returns a list of variables not provided in the given
-    dictionary."""
+    dictionary; nested names are joined with `keysep` (`KEYSEP` by
+    default). Issues are passed to `warn` (`qprompt.warn()` by default)."""
     def check_tmplitems(items, tmpldict, topkey=""):
         missing = []
         for key,val in items:
-            if type(val) == model.Dictionary:
+            if type(val) == jinja2schema.model.Dictionary:
                 missing += check_tmplitems(
                         val.items(),
                         tmpldict.get(key, {}),
-                        key if not topkey else "%s%s%s" % (topkey, KEYSEP, key))
+                        key if not topkey else "%s%s%s" % (topkey, keysep, key))
             else:
-                name = key if not topkey else "%s%s%s" % (topkey, KEYSEP, key)
+                name = key if not topkey else "%s%s%s" % (topkey, keysep, key)
                 try:
                     if key not in tmpldict.keys():
                         missing.append(name)
                 except:
-                    qprompt.warn("Issue checking var `%s`!" % (name))
+                    warn("Issue checking var `%s`!" % (name))
         return missing
 
     tmpldict = tmpldict or {}
+    keysep = keysep or KEYSEP
+    warn = warn or qprompt.warn
+    tmplvars = infer_vars(tmplstr)
+    if tmplvars is None:
+        return []
     try:
-        missing = check_tmplitems(infer(tmplstr).items(), tmpldict)
+        missing = check_tmplitems(tmplvars.items(), tmpldict)
     except:
         missing = []
     return missing
 
-def render_str(tmplstr, tmpldict, bail_miss=False):
+def render_str(tmplstr, tmpldict, bail_miss=False, checkvars=True):
     """Renders the given template string using the given template variable
-    dictionary. Returns the rendered text as a string."""
-    env = Environment(undefined=SkipUndefined, extensions=['jinja2_time.TimeExtension'])
-    env.trim_blocks = True
-    env.lstrip_blocks = True
-    miss = check_template(tmplstr, tmpldict)
-    if miss:
-        qprompt.warn("Template vars `%s` were not supplied values!" % (
-            "/".join(miss)))
-    return env.from_string(tmplstr).render(**tmpldict)
-
-def render_file(tmplpath, tmpldict, bail_miss=False):
+    dictionary. Returns the rendered text as a string. The check for missing
+    variables is skipped if `checkvars` is false."""
+    return _RENDERER.render_str(tmplstr, tmpldict, checkvars)
+
+def render_file(tmplpath, tmpldict, bail_miss=False, checkvars=True):
     """Renders the template file and the given path using the given template
-    variable dictionary. Returns the rendered text as a string."""
-    tmplpath = op.abspath(tmplpath)
-    env = Environment(undefined=SkipUndefined, extensions=['jinja2_time.TimeExtension'])
-    env.trim_blocks = True
-    env.lstrip_blocks = True
-    env.keep_trailing_newline = True
-    for encoding in ["utf-8", "mbcs"]:
-        try:
-            env.loader = FileSystemLoader(op.dirname(tmplpath), encoding=encoding)
-            tmpl = env.get_template(op.basename(tmplpath))
-            break
-        except UnicodeDecodeError:
-            qprompt.warn("Issue while decoding template with `%s`!" % encoding)
-    else:
-        qprompt.fatal("Unknown issue while loading template!")
-    with io.open(tmplpath) as fo:
-        tmplstr = fo.read()
-    miss = check_template(tmplstr, tmpldict)
-    if miss:
-        qprompt.warn("Template vars `%s` in `%s` were not supplied values!" % (
-            "/".join(miss),
-            op.basename(tmplpath)))
-    return tmpl.render(**tmpldict)
+    variable dictionary. Returns the rendered text as a string. The check for
+    missing variables is skipped if `checkvars` is false."""
+    return _RENDERER.render_file(tmplpath, tmpldict, checkvars)
+
+def stream_file(tmplpath, tmpldict, checkvars=True):
+    """Same as `render_file()` but returns an iterator over chunks of the
+    rendered text so the full output never needs to be held in memory."""
+    return _RENDERER.stream_file(tmplpath, tmpldict, checkvars)
 
 @handle_paths(inpath=0,outpath=2)
-def make(inpath, tmpldict, outpath=None, **kwargs):
+def make(inpath, tmpldict, outpath=None, checkvars=True, jobs=1, processes=False, incremental=False, linkbins=False, **kwargs):
     """Generates a file or directory based on the given input
-    template/dictionary."""
+    template/dictionary. If `incremental` is true, a manifest is kept next to
+    the output and outputs that have not changed are skipped."""
+    manifest = None
+    if incremental:
+        manifest = _get_manifest(inpath, tmpldict, outpath)
     if op.isfile(inpath):
-        return make_file(inpath, tmpldict, outpath=outpath, **kwargs)
+        retval = make_file(inpath, tmpldict, outpath=outpath, checkvars=checkvars,
+                manifest=manifest, linkbins=linkbins)
     else:
-        return make_dir(inpath, tmpldict, outpath=outpath, **kwargs)
+        retval = make_dir(inpath, tmpldict, outpath=outpath, checkvars=checkvars,
+                jobs=jobs, processes=processes, manifest=manifest, linkbins=linkbins, **kwargs)
+    if manifest:
+        manifest.save()
+        qprompt.info("Incremental make: %s." % (manifest.summary()))
+    return retval
+
+def make_targets(targets, tmpldict, jobs=1, **kwargs):
+    """Generates every `(inpath, outpath)` pair in the given targets. A single
+    target is passed to make() as is. With several targets, up to `jobs`
+    targets (0 for one per CPU) are generated concurrently using a single
+    job each, remote templates are only downloaded once and a failed target
+    does not stop the others. Returns a list of `(inpath, outpath, error)`
+    tuples in target order where `error` is None for successful targets."""
+    targets = list(targets)
+    if len(targets) < 2:
+        for inpath, outpath in targets:
+            make(inpath, tmpldict, outpath=outpath, jobs=jobs, **kwargs)
+        return [(inpath, outpath, None) for inpath, outpath in targets]
+    downloads = SharedDownloads()
+    work = functools.partial(_make_target_task, tmpldict=tmpldict,
+            downloads=downloads, **kwargs)
+    jobs = min(jobs or multiprocessing.cpu_count(), len(targets))
+    try:
+        if jobs > 1:
+            pool = mpool.ThreadPool(jobs)
+            try:
+                results = pool.map(work, targets)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [work(target) for target in targets]
+    finally:
+        downloads.close()
+    qprompt.hrule()
+    for inpath, outpath, error in results:
+        status = "OK" if error is None else "FAILED"
+        qprompt.echo("[%s] `%s` -> `%s`" % (status, inpath, outpath or "."))
+        if error is not None:
+            qprompt.echo("    " + error)
+    return results
 
-def make_file(inpath, tmpldict, outpath=None):
+def _make_target_task(target, tmpldict, downloads, **kwargs):
+    """Worker used by make_targets(). Returns an `(inpath, outpath, error)`
+    tuple where `error` describes why the target failed or is None."""
+    inpath, outpath = target
+    _LOCAL.worker = True
+    try:
+        kwargs['processes'] = False
+        if make(inpath, tmpldict, outpath=outpath, jobs=1, downloads=downloads, **kwargs) is False:
+            return inpath, outpath, "Output could not be made."
+        return inpath, outpath, None
+    except SystemExit as ex:
+        return inpath, outpath, "Exited with code %s." % (ex.code)
+    except utilconf.PromptNeeded:
+        raise
+    except Exception as ex:
+        return inpath, outpath, "%s: %s" % (type(ex).__name__, ex)
+    finally:
+        _LOCAL.worker = False
+
+def make_file(inpath, tmpldict, outpath=None, checkvars=True, manifest=None, linkbins=False, root=None):
     inpath = op.abspath(inpath)
     if outpath:
-        outpath = render_str(outpath, tmpldict)
+        outpath = render_str(outpath, tmpldict, checkvars=checkvars)
         if op.isdir(outpath):
             outpath = op.join(outpath, op.basename(inpath))
-            outpath = render_str(outpath, tmpldict)
-    if is_binary(inpath):
-        qprompt.status("Copying `%s`..." % (outpath), fsys.copy, [inpath,outpath])
-        return
-    text = render_file(inpath, tmpldict)
-    if text == None:
+            outpath = render_str(outpath, tmpldict, checkvars=checkvars)
+    if not outpath:
+        manifest = None
+    if "binary" == classify(inpath, root):
+        msg = ("Linking `%s`..." if linkbins else "Copying `%s`...") % (outpath)
+        if not manifest:
+            return _status(msg, copy_binary, [inpath, outpath, linkbins])
+        source = _hash_file(inpath)
+        if manifest.unchanged(outpath, source, None):
+            manifest.stats['skipped'] += 1
+            return True
+        if not _status(msg, copy_binary, [inpath, outpath, linkbins]):
+            return False
+        manifest.stats['written'] += 1
+        manifest.record(outpath, source, None, source)
+        return True
+    if manifest:
+        tmplstrs = _referenced_tmpls(inpath, _read_tmpl(inpath))
+        source = _hash_str("\0".join(tmplstrs)) if tmplstrs else None
+        context = _hash_context(tmplstrs, tmpldict)
+        if manifest.unchanged(outpath, source, context):
+            manifest.stats['skipped'] += 1
+            return True
+
+    # Handle rendered output. The output is streamed in chunks rather than
+    # rendered to a single string.
+    if not outpath:
+        _write_chunks(stream_file(inpath, tmpldict, checkvars=checkvars), sys.stdout)
+        sys.stdout.write("\n")
+        sys.stdout.flush()
+        return True
+    outpath = op.abspath(outpath)
+    if inpath == outpath:
+        qprompt.fatal("Output cannot overwrite input template!")
+    chunks = stream_file(inpath, tmpldict, checkvars=checkvars)
+    fsys.makedirs(op.dirname(outpath))
+
+    # Stream to a temporary file first so an existing output is left alone if
+    # rendering fails partway.
+    tmppath = "%s.__temp-poppage-%s" % (outpath, _getrands(6))
+    if not manifest:
+        try:
+            def write():
+                with io.open(tmppath, "w", encoding="utf-8", buffering=STREAM_BUFSIZE) as f:
+                    _write_chunks(chunks, f)
+                _replace(tmppath, outpath)
+            _status("Writing `%s`..." % (outpath), write, [])
+        finally:
+            if op.exists(tmppath):
+                os.remove(tmppath)
+        return True
+
+    # When making incrementally, an existing output with the same content is
+    # not touched.
+    manifest.stats['rendered'] += 1
+    sha = hashlib.sha1()
+    try:
+        with io.open(tmppath, "w", encoding="utf-8", buffering=STREAM_BUFSIZE) as f:
+            _write_chunks(chunks, f, sha)
+        output = sha.hexdigest()
+        manifest.record(outpath, source, context, output)
+        if op.isfile(outpath) and _hash_file(outpath) == output:
+            return True
+        manifest.stats['written'] += 1
+        _status("Writing `%s`..." % (outpath), _replace, [tmppath, outpath])
+    finally:
+        if op.exists(tmppath):
+            os.remove(tmppath)
+    return True
+
+def copy_binary(srcpath, dstpath, link=False):
+    """Copies the binary file at the source path to the destination path.
+    Kernel-side copying is used where available: a reflink, then
+    `copy_file_range()`, then `sendfile()`. If `link` is true, the file is
+    hardlinked instead, or symlinked if a hardlink is not possible; if `link`
+    is `hard`, the file is copied rather than symlinked. Returns true if
+    successful."""
+    srcpath = op.abspath(srcpath)
+    dstpath = op.abspath(dstpath)
+    if srcpath == dstpath:
         return False
+    fsys.makedirs(op.dirname(dstpath), ignore_extsep=True)
+    if op.lexists(dstpath):
+        if link and op.exists(dstpath) and op.samefile(srcpath, dstpath):
+            return True
+        os.remove(dstpath)
+    if link:
+        try:
+            os.link(srcpath, dstpath)
+            return True
+        except (AttributeError, OSError):
+            if "hard" != link:
+                os.symlink(srcpath, dstpath)
+                return True
+    with io.open(srcpath, "rb") as fsrc:
+        with io.open(dstpath, "wb") as fdst:
+            _copy_fileobj(fsrc, fdst, os.fstat(fsrc.fileno()).st_size)
+    shutil.copystat(srcpath, dstpath)
+    return op.isfile(dstpath)
 
-    # Handle rendered output.
-    if outpath:
-        outpath = op.abspath(outpath)
-        if inpath == outpath:
-            qprompt.fatal("Output cannot overwrite input template!")
-        fsys.makedirs(op.dirname(outpath))
-        with io.open(outpath, "w", encoding="utf-8") as f:
-            qprompt.status("Writing `%s`..." % (outpath), f.write, [text])
+def _copy_fileobj(fsrc, fdst, size):
+    """Copies the contents of one open file to another, preferring methods
+    that avoid copying the data through user space."""
+    infd, outfd = fsrc.fileno(), fdst.fileno()
+    try:
+        import fcntl
+        fcntl.ioctl(outfd, FICLONE, infd)
+        return
+    except (ImportError, IOError, OSError):
+        pass
+    for name in ["copy_file_range", "sendfile"]:
+        if not hasattr(os, name) or not sys.platform.startswith("linux"):
+            continue
+        copied = 0
+        try:
+            while copied < size:
+                if "sendfile" == name:
+                    sent = os.sendfile(outfd, infd, copied, size - copied)
+                else:
+                    sent = os.copy_file_range(infd, outfd, size - copied)
+                if not sent:
+                    break
+                copied += sent
+            if copied == size:
+                return
+        except OSError:
+            if copied:
+                raise
+    fsrc.seek(0)
+    fdst.seek(0)
+    fdst.truncate()
+    shutil.copyfileobj(fsrc, fdst, STREAM_BUFSIZE)
+
+def _write_chunks(chunks, fo, sha=None):
+    """Writes the given chunks of text to the given file object. Optionally
+    updates the given hash with the bytes as written to disk."""
+    for chunk in chunks:
+        fo.write(chunk)
+        if sha:
+            sha.update(chunk.replace("\n", os.linesep).encode("utf-8"))
+
+def _replace(srcpath, dstpath):
+    """Moves the given file over the given destination path, keeping the mode
+    of an existing destination."""
+    if op.isfile(dstpath):
+        shutil.copymode(dstpath, srcpath)
+    if hasattr(os, "replace"):
+        os.replace(srcpath, dstpath)
+    else:
+        if op.exists(dstpath):
+            os.remove(dstpath)
+        os.rename(srcpath, dstpath)
+
+def make_dir(inpath, tmpldict, outpath=None, pathsubs=None, checkvars=True, jobs=1, processes=False, manifest=None, linkbins=False):
+    """Generates a directory based on the given input template directory.
+    Directories are created in order first, then files are rendered and
+    written using up to `jobs` worker threads (or processes if `processes` is
+    true). If any files fail, the first failure in template order is
+    reported."""
+    tasks = []
+    if not _plan_dir(inpath, tmpldict, outpath, pathsubs or [], checkvars, tasks):
+        return False
+    work = functools.partial(_make_file_task, tmpldict=tmpldict, checkvars=checkvars,
+            manifest=manifest, linkbins=linkbins, root=op.abspath(inpath))
+    jobs = min(jobs or multiprocessing.cpu_count(), len(tasks))
+    if jobs > 1:
+        pool = (multiprocessing.Pool if processes else mpool.ThreadPool)(jobs)
+        try:
+            results = pool.map(work, tasks)
+        finally:
+            pool.close()
+            pool.join()
     else:
-        qprompt.echo(text)
+        results = []
+        for task in tasks:
+            results.append(work(task))
+            if not results[-1][0]:
+                break
+    for retval, error, changes in results:
+        if manifest and changes:
+            manifest.merge(*changes)
+        if error is not None:
+            raise error
+        if not retval:
+            return False
     return True
 
-def make_dir(inpath, tmpldict, outpath=None, pathsubs=None):
-    pathsubs = pathsubs or []
+def _plan_dir(inpath, tmpldict, outpath, pathsubs, checkvars, tasks):
+    """Creates the output directories for the given input template directory
+    and appends a `(inpath, outpath)` task to `tasks` for every file to
+    generate. Returns False if the directory could not be made."""
     inpath = op.abspath(inpath)
     bpath = op.basename(inpath)
     if not outpath:
         outpath = os.getcwd()
-    dname = render_str(bpath, tmpldict)
+    dname = render_str(bpath, tmpldict, checkvars=checkvars)
     if not dname:
         return False
     mpath = op.abspath(op.join(outpath, dname))
@@ -282,37 +1183,138 @@ def make_dir(inpath, tmpldict, outpath=None, pathsubs=None):
         mpath = mpath.replace(*sub)
     if inpath == mpath:
         qprompt.fatal("Output cannot overwrite input template!")
-    mpath = render_str(mpath, tmpldict)
-    qprompt.status("Making dir `%s`..." % (mpath), fsys.makedirs, [mpath])
+    mpath = render_str(mpath, tmpldict, checkvars=checkvars)
+    _status("Making dir `%s`..." % (mpath), fsys.makedirs, [mpath])
 
     # Iterate over files and directories IN PARENT ONLY.
     for r,ds,fs in os.walk(inpath):
-        for f in fs:
-            ipath = op.join(r,f)
-            fname = render_str(f, tmpldict)
-            opath = op.join(mpath, fname)
-            if not make_file(ipath, tmpldict, opath):
-                return False
-        for d in ds:
-            ipath = op.join(r, d)
-            if not make_dir(ipath, tmpldict, mpath, pathsubs=pathsubs):
+        for f in sorted(fs):
+            if TYPEMAP == f:
+                continue
+            fname = render_str(f, tmpldict, checkvars=checkvars)
+            tasks.append((op.join(r, f), op.join(mpath, fname)))
+        for d in sorted(ds):
+            if not _plan_dir(op.join(r, d), tmpldict, mpath, pathsubs, checkvars, tasks):
                 return False
         break # Prevents from walking beyond parent.
     return True
 
+def _make_file_task(task, tmpldict, checkvars, manifest=None, linkbins=False, root=None):
+    """Worker used by make_dir(). Returns a `(retval, error, changes)` tuple
+    so that errors and manifest changes can be handled in template order
+    rather than completion order."""
+    worker = getattr(_LOCAL, "worker", False)
+    _LOCAL.worker = True
+    manifest = manifest.fork() if manifest else None
+    changes = (manifest.changes, manifest.stats) if manifest else None
+    try:
+        retval = make_file(task[0], tmpldict, task[1], checkvars=checkvars,
+                manifest=manifest, linkbins=linkbins, root=root)
+        return retval, None, changes
+    except SystemExit as ex:
+        return False, SystemExit(ex.code), changes
+    except Exception as ex:
+        return False, ex, changes
+    finally:
+        _LOCAL.worker = worker
+
+def _get_manifest(inpath, tmpldict, outpath):
+    """Returns the incremental make manifest for the given output path or None
+    if the output is not written to disk."""
+    if op.isfile(inpath):
+        if not outpath:
+            return None
+        outpath = op.abspath(render_str(outpath, tmpldict, checkvars=False))
+        if not op.isdir(outpath):
+            outpath = op.dirname(outpath)
+    else:
+        outpath = op.abspath(render_str(outpath or os.getcwd(), tmpldict, checkvars=False))
+    return Manifest(outpath)
+
+def _referenced_tmpls(inpath, tmplstr):
+    """Returns the given template text followed by the text of every
+    template it includes, extends or imports from its directory, found
+    recursively. Returns None if a reference is dynamic or cannot be
+    read."""
+    env = get_env("file")
+    dirpath = op.dirname(op.abspath(inpath))
+    tmplstrs = [tmplstr]
+    seen = set()
+    pending = [tmplstr]
+    while pending:
+        try:
+            names = list(meta.find_referenced_templates(env.parse(pending.pop())))
+        except Exception:
+            return None
+        for name in names:
+            if name is None:
+                return None
+            if name in seen:
+                continue
+            seen.add(name)
+            path = op.join(dirpath, *name.split("/"))
+            if not op.isfile(path):
+                return None
+            pending.append(_read_tmpl(path))
+            tmplstrs.append(pending[-1])
+    return tmplstrs
+
+def _hash_str(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+def _hash_file(path):
+    sha = hashlib.sha1()
+    with io.open(path, "rb") as fi:
+        for chunk in iter(lambda: fi.read(65536), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+def _hash_context(tmplstrs, tmpldict):
+    """Returns a hash of the template dictionary values used by the given
+    template strings. All values are used if any template cannot be
+    analyzed."""
+    keys = set()
+    for tmplstr in tmplstrs or [None]:
+        tmplvars = infer_vars(tmplstr) if tmplstr != None else None
+        if tmplvars is None:
+            keys = tmpldict.keys()
+            break
+        keys.update(tmplvars.keys())
+    values = [[k, tmpldict.get(k)] for k in sorted(keys)]
+    return _hash_str(json.dumps(values, sort_keys=True, default=repr))
+
+def _status(msg, func, args):
+    """Same as `qprompt.status()` but prints a single line when called from a
+    make_dir() worker so that concurrent output is not interleaved."""
+    if not getattr(_LOCAL, "worker", False):
+        return qprompt.status(msg, func, args)
+    retval = func(*args)
+    _echo("[!] %s DONE." % (msg))
+    return retval
+
+def _echo(text):
+    """Prints the given line with a single write so lines printed by
+    concurrent workers are never merged."""
+    with _ECHOLOCK:
+        sys.stdout.write(text + "\n")
+        sys.stdout.flush()
+
 @handle_paths(inpath=0)
 def check(inpath, echo=False, **kwargs):
-    """Checks the inpath template for variables."""
+    """Checks the inpath template for variables. The template is scanned in a
+    single pass so each path is only visited and analyzed once."""
     tvars = check_template(op.basename(inpath))
     if op.isfile(inpath):
-        if not is_binary(inpath):
-            with io.open(inpath) as fi:
-                tvars += check_template(fi.read())
+        tvars += _check_file(inpath)
     else:
         for r,ds,fs in os.walk(inpath):
-            for x in ds+fs:
-                xpath = op.join(r,x)
-                tvars += check(xpath)
+            for d in ds:
+                tvars += check_template(d)
+            for f in fs:
+                if TYPEMAP == f:
+                    continue
+                tvars += check_template(f)
+                tvars += _check_file(op.join(r, f), inpath)
     tvars = sorted(list(set(tvars)))
     if echo:
         qprompt.echo("Found variables:")
@@ -320,58 +1322,435 @@ def check(inpath, echo=False, **kwargs):
             qprompt.echo("  " + var)
     return tvars
 
-def run(inpath, tmpldict, outpath=None, execute=None, runargs=None):
-    """Handles logic for `run` command."""
+def used_keys(inpaths, tmplstrs=None):
+    """Returns the set of top-level template dictionary keys used by the given
+    local template files/directories and the given extra template strings
+    (e.g. OUTPATH). Returns None if any of them cannot be analyzed, in which
+    case every key should be considered used."""
+    keys = set()
+    def add(tmplstr):
+        tmplvars = infer_vars(tmplstr)
+        if tmplvars is None:
+            return False
+        keys.update(tmplvars.keys())
+        return True
+    for tmplstr in tmplstrs or []:
+        if tmplstr and not add(tmplstr):
+            return None
+    for inpath in inpaths:
+        if not inpath or gitr.is_github(inpath) or not op.exists(inpath):
+            return None
+        if not add(op.basename(inpath)):
+            return None
+        paths = [inpath]
+        if op.isdir(inpath):
+            paths = []
+            for r,ds,fs in os.walk(inpath):
+                for name in ds + fs:
+                    if TYPEMAP == name:
+                        continue
+                    if not add(name):
+                        return None
+                    paths.append(op.join(r, name))
+        for path in paths:
+            if op.isfile(path) and "binary" != classify(path, inpath if op.isdir(inpath) else None):
+                if not add(_read_tmpl(path)):
+                    return None
+    return keys
+
+def _check_file(path, root=None):
+    """Returns the variables found in the contents of the given template
+    file."""
+    if "binary" == classify(path, root):
+        return []
+    return check_template(_read_tmpl(path))
+
+@handle_paths(inpath=0)
+def batch(inpath, tmpldict, contexts, outpath=None, keysep=KEYSEP, **kwargs):
+    """Generates the given template once for every template dictionary in the
+    given contexts iterable; each one is applied on top of `tmpldict`. The
+    contexts are consumed one at a time so they can be streamed. Returns the
+    number of contexts rendered or False if an output could not be made."""
+    count = 0
+    for ctx in contexts:
+        ctxdict = utilconf.LayeredDict(utilconf.nest_keys(ctx, keysep), tmpldict)
+        if not make(inpath, ctxdict, outpath=outpath, **kwargs):
+            return False
+        count += 1
+    return count
+
+def iter_contexts(path):
+    """Yields template dictionaries one at a time from the given JSON Lines
+    file, multi-document YAML file, or stdin if the path is `-`."""
+    if "-" == path:
+        lines = sys.stdin
+    elif path.lower().endswith((".yaml", ".yml")):
+        with io.open(path, encoding="utf-8") as fi:
+            for ctx in yaml.load_all(fi, Loader=utilconf.get_loader()):
+                if ctx != None:
+                    yield ctx
+        return
+    else:
+        lines = io.open(path, encoding="utf-8")
+    try:
+        for line in lines:
+            if line.strip():
+                yield json.loads(line)
+    finally:
+        if lines is not sys.stdin:
+            lines.close()
+
+def run(inpath, tmpldict, outpath=None, execute=None, runargs=None, checkvars=True, jobs=1, processes=False, scratch=None):
+    """Handles logic for `run` command. If no `outpath` is given, the output
+    is generated in a temporary directory under `scratch` (defaults to the
+    current directory). The output is deleted even if the run fails or is
+    terminated."""
     if not outpath:
-        outpath = op.join(os.getcwd(), "__temp-poppage-" + _getrands(6))
-    make(inpath, tmpldict, outpath=outpath)
-    qprompt.hrule()
-    if not execute:
-        execute = outpath
-    tmpldict.update({'outpath': outpath})
-    tmpldict.update({'runargs': " ".join(runargs or [])})
-    execute = render_str(execute, tmpldict)
+        scratch = op.abspath(scratch or os.getcwd())
+        if not op.isdir(scratch):
+            os.makedirs(scratch)
+        outpath = op.join(scratch, "__temp-poppage-" + _getrands(6))
+    restore = _exit_on_term()
+    try:
+        make(inpath, tmpldict, outpath=outpath, checkvars=checkvars, jobs=jobs, processes=processes)
+        qprompt.hrule()
+        if not execute:
+            execute = outpath
+        rundict = utilconf.LayeredDict({
+            'outpath': outpath,
+            'runargs': " ".join(runargs or [])}, tmpldict)
+        execute = render_str(execute, rundict, checkvars=checkvars)
+        return run_execute(execute, jobs)
+    finally:
+        restore()
+        fsys.delete(outpath)
+
+def _exit_on_term():
+    """Turns SIGTERM into a normal exit so that pending `finally` cleanup
+    runs. Returns a function that restores the previous handler. Does nothing
+    outside the main thread since only it can set signal handlers."""
+    def on_term(signum, frame):
+        sys.exit(128 + signum)
+    try:
+        prev = signal.signal(signal.SIGTERM, on_term)
+    except ValueError:
+        return lambda: None
+    return lambda: signal.signal(signal.SIGTERM, prev if prev is not None else signal.SIG_DFL)
+
+def run_execute(execute, jobs=1):
+    """Runs the command lines of the given rendered execute block in order.
+    Consecutive lines starting with `&` form a parallel group: they run
+    concurrently (using up to `jobs` threads if more than 1) with their output
+    captured and shown per command once done, and the next line only starts
+    after the whole group finishes. Other lines run one at a time with live
+    output. Returns a list of `(cmd, exitcode, seconds)` tuples in line order
+    and reports them if any group was used or a command failed."""
+    results = []
+    grouped = False
+    for group in _exec_groups(execute):
+        if len(group) == 1 and not group[0].startswith("&"):
+            start = time.time()
+            code = sh.call(group[0])
+            results.append((group[0], code, time.time() - start))
+            continue
+        grouped = True
+        cmds = [line[1:].strip() for line in group]
+        size = min(len(cmds), jobs if jobs > 1 else len(cmds))
+        pool = mpool.ThreadPool(size)
+        try:
+            for result in pool.imap(_exec_captured, cmds):
+                results.append(result[:3])
+                qprompt.echo("[%s] %s" % (result[1], result[0]))
+                if result[3]:
+                    qprompt.echo(result[3], end="" if result[3].endswith("\n") else "\n")
+        finally:
+            pool.close()
+            pool.join()
+    if grouped or any(r[1] for r in results):
+        _report_execute(results)
+    return results
+
+def _exec_groups(execute):
+    """Yields lists of command lines; either a single sequential line or the
+    lines of a parallel group."""
+    group = []
     for line in execute.splitlines():
-        sh.call(line.strip())
-    fsys.delete(outpath)
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith("&"):
+            group.append(line)
+            continue
+        if group:
+            yield group
+            group = []
+        yield [line]
+    if group:
+        yield group
 
-def main():
+def _exec_captured(cmd):
+    """Runs the given command with its output captured. Returns a
+    `(cmd, exitcode, seconds, output)` tuple."""
+    start = time.time()
+    proc = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT, universal_newlines=True)
+    output = proc.communicate()[0]
+    return cmd, proc.returncode, time.time() - start, output
+
+def _report_execute(results):
+    qprompt.hrule()
+    for cmd, code, secs in results:
+        qprompt.echo("%-4s %7.2fs  %s" % ("OK" if 0 == code else code, secs, cmd))
+
+##--------------------------------------------------------------#
+## Daemon Functions                                             #
+##--------------------------------------------------------------#
+
+class _NoInput(object):
+    """Stands in for stdin while handling a forwarded call; reading raises
+    `PromptNeeded` so the call can be run by the client instead."""
+    encoding = "utf-8"
+    def read(self, *args):
+        raise utilconf.PromptNeeded("stdin")
+    readline = read
+    def isatty(self):
+        return False
+
+class _StreamWriter(object):
+    """File-like object that forwards written text to a serve client as
+    messages of the given kind (`out` or `err`)."""
+    encoding = "utf-8"
+    def __init__(self, wfile, kind):
+        self.wfile = wfile
+        self.kind = kind
+    def write(self, text):
+        if text:
+            _send_msg(self.wfile, {self.kind: text})
+    def flush(self):
+        pass
+    def isatty(self):
+        return False
+
+def _send_msg(wfile, msg):
+    wfile.write((json.dumps(msg) + "\n").encode("utf-8"))
+    wfile.flush()
+
+def serve(sockpath=None):
+    """Handles forwarded calls and render requests on the given Unix socket
+    until interrupted. Calls are handled one at a time since each call
+    changes the working directory and environment of the process."""
+    if not hasattr(socket, "AF_UNIX"):
+        qprompt.fatal("Unix sockets are not supported on this platform!")
+    sockpath = sockpath or utilconf.get_sockpath()
+    if op.exists(sockpath):
+        if forward_call([], sockpath) != None:
+            qprompt.fatal("Already serving on `%s`!" % (sockpath))
+        os.remove(sockpath)
+    fsys.makedirs(op.dirname(sockpath))
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            req = json.loads(self.rfile.readline().decode("utf-8") or "{}")
+            if req.get('argv'):
+                code = _serve_call(req['argv'], req['cwd'], req['env'], self.wfile)
+            elif req.get('render'):
+                code = _serve_render(req['render'], req.get('cwd'), self.wfile)
+            else:
+                code = 0
+            if code is None:
+                _send_msg(self.wfile, {'local': True})
+            else:
+                _send_msg(self.wfile, {'code': code})
+    global _SERVING
+    _SERVING = True
+    server = socketserver.UnixStreamServer(sockpath, Handler)
+    qprompt.alert("Serving on `%s`..." % (sockpath))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        _SERVING = False
+        server.server_close()
+        if op.exists(sockpath):
+            os.remove(sockpath)
+
+def _serve_call(argv, cwd, env, wfile):
+    """Runs main() for a forwarded call with the output sent to the client.
+    Returns the exit code or None if the call needs to prompt the user and
+    should be run by the client instead."""
+    oldcwd = os.getcwd()
+    oldenv = dict(os.environ)
+    stdio = sys.stdin, sys.stdout, sys.stderr
+    code = 0
+    try:
+        os.chdir(cwd)
+        os.environ.clear()
+        os.environ.update(env)
+        sys.stdin = _NoInput()
+        sys.stdout = _StreamWriter(wfile, "out")
+        sys.stderr = _StreamWriter(wfile, "err")
+        utilconf._NOPROMPT = True
+        main(argv)
+    except utilconf.PromptNeeded:
+        return None
+    except SystemExit as exc:
+        code = exc.code
+        if code != None and not isinstance(code, int):
+            sys.stderr.write("%s\n" % (code))
+            code = 1
+    except Exception:
+        traceback.print_exc()
+        code = 1
+    finally:
+        utilconf._NOPROMPT = False
+        sys.stdin, sys.stdout, sys.stderr = stdio
+        os.environ.clear()
+        os.environ.update(oldenv)
+        os.chdir(oldcwd)
+    return code or 0
+
+def _serve_render(render, cwd, wfile):
+    """Renders the template string (`tmplstr`) or template file (`inpath`,
+    relative to the given directory) of a render request with its template
+    dictionary (`tmpldict`) and sends the output to the client. Warnings and
+    errors are sent as `err` messages. Returns the exit code."""
+    stdio = sys.stdout, sys.stderr
+    try:
+        sys.stdout = sys.stderr = _StreamWriter(wfile, "err")
+        tmpldict = render.get('tmpldict') or {}
+        if render.get('inpath'):
+            out = render_file(op.join(cwd or os.getcwd(), render['inpath']), tmpldict)
+        else:
+            out = render_str(render.get('tmplstr') or "", tmpldict)
+    except Exception as ex:
+        sys.stderr.write("%s: %s\n" % (type(ex).__name__, ex))
+        return 1
+    finally:
+        sys.stdout, sys.stderr = stdio
+    _send_msg(wfile, {'out': out})
+    return 0
+
+def forward_call(argv, sockpath):
+    """Forwards the given CLI arguments to a serve daemon listening on the
+    given socket and relays its output. Returns the exit code or None if no
+    daemon could be reached or the call needs to prompt the user, in which
+    case it should be run locally."""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(sockpath)
+    except (IOError, OSError):
+        sock.close()
+        return None
+    code = None
+    with contextlib.closing(sock):
+        req = {'argv': argv, 'cwd': os.getcwd(), 'env': dict(os.environ)}
+        sock.sendall((json.dumps(req) + "\n").encode("utf-8"))
+        for line in sock.makefile("rb"):
+            msg = json.loads(line.decode("utf-8"))
+            if "out" in msg:
+                sys.stdout.write(msg['out'])
+            elif "err" in msg:
+                sys.stderr.write(msg['err'])
+            elif "code" in msg:
+                code = msg['code']
+            elif "local" in msg:
+                code = None
+    sys.stdout.flush()
+    return code
+
+def _forwardable(argv):
+    """Returns true if the given CLI call can be handled by a serve daemon."""
+    return argv[:1] in [["batch"], ["check"], ["make"]] and "-" not in argv
+
+def main(argv=None):
     """This function implements the main logic."""
-    if len(sys.argv) > 1 and op.isfile(sys.argv[1]):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    sockpath = os.environ.get("POPPAGE_SOCKET")
+    if sockpath and not _SERVING and _forwardable(argv) and hasattr(socket, "AF_UNIX"):
+        code = forward_call(argv, sockpath)
+        if code != None:
+            sys.exit(code)
+    if len(argv) > 0 and op.isfile(argv[0]):
         args = {}
-        args['--defaults'] = sys.argv[1]
+        args['--defaults'] = argv[0]
         args['--file'] = []
         args['--keysep'] = "::"
         args['--string'] = []
         args['PATH'] = []
         args['VAL'] = []
-        args['runargs'] = sys.argv[2:] or ""
+        args['runargs'] = argv[1:] or ""
     else:
-        args = docopt(__doc__, version="poppage-%s" % (__version__))
+        args = docopt(__doc__, argv=argv, version="poppage-%s" % (__version__))
+    if args.get('serve'):
+        return serve(args['--socket'])
     utildict, tmpldict = utilconf.parse(args)
+    use_bytecode_cache(utildict['cache'])
+    use_template_cache(utildict['cache'] or utildict['offline'], offline=utildict['offline'])
 
     # Check required conditions.
     if not utildict.get('inpath'):
         qprompt.fatal("Must supply INPATH!")
 
-    # Handle command.
+    # Resolve lazy values that are needed.
+    if utildict['lazy'] and utildict['command'] != "check":
+        keys = None
+        if utildict['command'] in ["make", "run", "batch"]:
+            keys = used_keys(utildict['inpath'], utildict['outpath'] + [utildict.get('execute')])
+        utilconf.resolve_lazy(tmpldict, keys)
+
+    try:
+        handle_command(args, utildict, tmpldict)
+    except TemplateReadError as ex:
+        qprompt.fatal(str(ex))
+
+def handle_command(args, utildict, tmpldict):
+    """Runs the command given in the utility dictionary."""
     if utildict['command'] == "check":
         check(utildict['inpath'][0], echo=True)
     elif utildict['command'] == "make":
-        for inpath, outpath in zip(utildict['inpath'], utildict['outpath']):
-            make(inpath, tmpldict, outpath=outpath)
+        results = make_targets(
+                zip(utildict['inpath'], utildict['outpath']),
+                tmpldict,
+                checkvars=utildict['checkvars'],
+                jobs=utildict['jobs'],
+                processes=utildict['processes'],
+                incremental=utildict['incremental'],
+                linkbins=utildict['linkbins'])
+        failed = [r for r in results if r[2] is not None]
+        if failed:
+            qprompt.fatal("%u of %u targets failed!" % (len(failed), len(results)))
     elif utildict['command'] == "run":
         run(
                 utildict['inpath'][0],
                 tmpldict,
                 outpath=utildict['outpath'][0],
                 execute=utildict.get('execute'),
-                runargs=utildict.get('runargs'))
+                runargs=utildict.get('runargs'),
+                checkvars=utildict['checkvars'],
+                jobs=utildict['jobs'],
+                processes=utildict['processes'],
+                scratch=utildict.get('scratch'))
+    elif utildict['command'] == "batch":
+        if not utildict.get('contexts'):
+            qprompt.fatal("Must supply CONTEXTS!")
+        ok = batch(
+                utildict['inpath'][0],
+                tmpldict,
+                iter_contexts(utildict['contexts']),
+                outpath=utildict['outpath'][0],
+                keysep=args['--keysep'],
+                checkvars=utildict['checkvars'],
+                jobs=utildict['jobs'],
+                processes=utildict['processes'],
+                incremental=utildict['incremental'],
+                linkbins=utildict['linkbins'])
+        if ok is False:
+            qprompt.fatal("Batch generation failed!")
     elif utildict['command'] == "debug":
         qprompt.echo("Utility Dictionary:")
-        pprint(utildict)
+        pprint.pprint(utildict)
         qprompt.echo("Template Dictionary:")
-        pprint(tmpldict)
+        pprint.pprint(utilconf.LayeredDict(tmpldict).to_dict())
 
 ##==============================================================#
 ## SECTION: Main Body                                           #
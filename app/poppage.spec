@@ -1,7 +1,7 @@
 # -*- mode: python -*-
 a = Analysis(['poppage.py'],
              pathex=['__output__'],
-             hiddenimports=[],
+             hiddenimports=['auxly.filesys', 'auxly.shell', 'binaryornot.helpers', 'jinja2_time', 'jinja2schema', 'multiprocessing.pool', 'qprompt', 'requests', 'yaml'],
              hookspath=None,
              runtime_hooks=None)
 
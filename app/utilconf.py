@@ -3,49 +3,191 @@
 ##==============================================================#
 
 import collections
+import hashlib
+import importlib
 import io
+import json
 import os
 import os.path as op
+import pickle
+import time
 
-import yaml
-import qprompt
-import auxly.filesys as fsys
-import auxly.shell as sh
-
-#: TODO: This is a bit hacky and will be cleaned up in the future.
-_DFLTFILE = None
+try:
+    from collections.abc import Mapping, MutableMapping
+except ImportError:
+    from collections import Mapping, MutableMapping
 
 ##==============================================================#
 ## SECTION: Class Definitions                                   #
 ##==============================================================#
 
+class LazyModule(object):
+    """Stands in for the named module, which is only imported when one of its
+    attributes is first accessed. Used to keep startup fast by deferring
+    dependencies to the code paths that need them."""
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+    def __getattr__(self, attr):
+        module = self.__dict__['_module']
+        if module is None:
+            module = importlib.import_module(self.__dict__['_name'])
+            self.__dict__['_module'] = module
+        return getattr(module, attr)
+    def __repr__(self):
+        return "<lazy module '%s'>" % (self.__dict__['_name'])
+
+class LayeredDict(MutableMapping):
+    """Template dictionary made of layers of dictionaries that are shared
+    rather than copied, similar to `collections.ChainMap`. Earlier layers
+    take priority. Unlike `ChainMap`, nested dictionaries found in several
+    layers are merged into a plain dictionary when read, the same way as
+    `update()` would merge them, so templates only ever see plain values.
+    Writes go to the first layer; deleting a key removes it from every
+    layer."""
+    def __init__(self, *maps):
+        self.maps = list(maps) or [{}]
+    def __getitem__(self, key):
+        found = [m[key] for m in self.maps if key in m]
+        if not found:
+            raise KeyError(key)
+        if isinstance(found[0], Mapping):
+            nested = []
+            for val in found:
+                if not isinstance(val, Mapping):
+                    break
+                nested.append(val)
+            if len(nested) > 1:
+                return _merge_layers(nested)
+        return found[0]
+    def __setitem__(self, key, val):
+        self.maps[0][key] = val
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        for m in self.maps:
+            if key in m:
+                del m[key]
+    def __contains__(self, key):
+        return any(key in m for m in self.maps)
+    def __iter__(self):
+        seen = set()
+        for m in reversed(self.maps):
+            for key in m:
+                if key not in seen:
+                    seen.add(key)
+                    yield key
+    def __len__(self):
+        return len(set().union(*self.maps))
+    def __repr__(self):
+        return "LayeredDict(%r)" % (self.to_dict())
+    def new_child(self, m=None):
+        """Returns a new layered dictionary with the given dictionary (or an
+        empty one) on top of the layers of this one."""
+        return LayeredDict(m if m != None else {}, *self.maps)
+    def to_dict(self):
+        """Returns the merged content as a plain dictionary."""
+        return {k:v for k,v in self.items()}
+
+yaml = LazyModule("yaml")
+qprompt = LazyModule("qprompt")
+fsys = LazyModule("auxly.filesys")
+mpool = LazyModule("multiprocessing.pool")
+sh = LazyModule("auxly.shell")
+
+#: TODO: This is a bit hacky and will be cleaned up in the future.
+_DFLTFILE = None
+
+#: Parsed YAML documents keyed by path. Each entry holds the pickled document
+#: and the files it was built from along with their modification time and
+#: size when parsed.
+_DOCCACHE = {}
+
+#: Stack of the YAML documents currently being loaded; custom tags record the
+#: files they read and whether their result can change on every load.
+_LOADING = []
+
+#: If true, parsed YAML documents are also cached on disk across runs.
+_DISKCACHE = False
+
+#: Maximum number of `!cmd` commands run concurrently.
+CMD_JOBS = 8
+
+#: Output of the `!cmd` commands run so far, keyed by command; reset for every
+#: parse so each command only runs once per run.
+_CMDRESULTS = {}
+
+#: If true, output of `!cmd` commands with a TTL is cached on disk.
+_CMDCACHE = True
+
+#: If true, `!file`, `!cmd`, `!ask` and `--file` values are loaded as thunks
+#: that are only resolved when needed.
+_LAZY = False
+
+#: If true, `!ask` raises `PromptNeeded` rather than prompting (e.g. while
+#: handling a call forwarded to a serve daemon).
+_NOPROMPT = False
+
 ##--------------------------------------------------------------#
 ## Custom YAML Tag Classes                                      #
 ##--------------------------------------------------------------#
 
 class CmdExec(str):
-    def __new__(cls, cmd):
-        return str.__new__(cls, sh.strout(cmd))
+    def __new__(cls, cmd, ttl=None):
+        return str.__new__(cls, run_cmd(cmd, ttl))
     def __repr__(self):
         return self
+    def __reduce__(self):
+        return (str, (str(self),))
+
+class Thunk(object):
+    """Deferred template dictionary value that is computed by calling the
+    given function with the given arguments when first resolved. Converting
+    the thunk to a string resolves it, so values missed by the analysis of
+    what a template uses still render correctly."""
+    def __init__(self, func, *args):
+        self.func = func
+        self.args = args
+        self.done = False
+        self.value = None
+    def resolve(self):
+        if not self.done:
+            self.value = self.func(*self.args)
+            self.done = True
+        return self.value
+    def __str__(self):
+        return str(self.resolve())
+    def __repr__(self):
+        return "Thunk(%s%r)" % (getattr(self.func, "__name__", "?"), self.args)
+
+class CmdPending(Thunk):
+    """Placeholder for a `!cmd` value. The commands of a document are run
+    together once the document has been loaded (see `resolve_cmds()`), or
+    once needed in lazy mode."""
+    def __init__(self, cmd, ttl=None):
+        Thunk.__init__(self, CmdExec, cmd, ttl)
+        self.cmd = cmd
+        self.ttl = ttl
 
 class FileReader(str):
     def __new__(cls, fpath):
         if not op.isabs(fpath):
             global _DFLTFILE
             fpath = op.normpath(op.join(op.dirname(_DFLTFILE), fpath))
+        _note_deps({op.abspath(fpath): _statkey(fpath)})
         with io.open(fpath) as fi:
             return str.__new__(cls, fi.read().strip())
     def __repr__(self):
         return self
+    def __reduce__(self):
+        return (str, (str(self),))
 
 class OptLoader(object):
     def __new__(cls, fpath):
         if not op.isabs(fpath):
             global _DFLTFILE
             fpath = op.normpath(op.join(op.dirname(_DFLTFILE), fpath))
-        with io.open(fpath) as fi:
-            opt = yaml.load(fi.read(), Loader=yaml.Loader)
+        opt = load_yaml(fpath)
         # TODO: Clean up, perhaps make function that can be called by get_defopts.
         if "inpath" in opt.keys():
             if not opt['inpath'].startswith("http"):
@@ -59,16 +201,23 @@ class IncLoader(object):
         if not op.isabs(fpath):
             global _DFLTFILE
             fpath = op.normpath(op.join(op.dirname(_DFLTFILE), fpath))
-        with io.open(fpath) as fi:
-            return yaml.load(fi.read(), Loader=yaml.Loader)
+        return load_yaml(fpath)
     def __repr__(self):
         return str(self)
 
+class PromptNeeded(Exception):
+    """Raised instead of prompting the user when prompts are disabled."""
+
 class AskPrompter(str):
     def __new__(cls, msg):
+        if _NOPROMPT:
+            raise PromptNeeded(msg)
+        _note_volatile()
         return str.__new__(cls, qprompt.ask_str(msg))
     def __repr__(self):
         return self
+    def __reduce__(self):
+        return (str, (str(self),))
 
 ##==============================================================#
 ## SECTION: Function Definitions                                #
@@ -81,26 +230,48 @@ def update(d, u):
     """Updates a dictionary without replacing nested dictionaries. Code
     found from `https://stackoverflow.com/a/3233356`."""
     for k, v in u.items():
-        if isinstance(v, collections.Mapping):
+        if isinstance(v, Mapping):
             r = update(d.get(k, {}), v)
             d[k] = r
         else:
             d[k] = u[k]
     return d
 
+def _merge_layers(layers):
+    """Returns a plain dictionary merging the given dictionaries; earlier
+    ones take priority. Only nested dictionaries found in several layers are
+    copied."""
+    merged = {}
+    for layer in reversed(layers):
+        for key, val in layer.items():
+            if isinstance(val, Mapping) and isinstance(merged.get(key), Mapping):
+                val = _merge_layers([val, merged[key]])
+            merged[key] = val
+    return merged
+
 ##--------------------------------------------------------------#
 ## Custom YAML Tag Functions                                    #
 ##--------------------------------------------------------------#
 
 def ctor_cmd(loader, node):
+    if not _LAZY:
+        _note_volatile()
+    if isinstance(node, yaml.MappingNode):
+        value = loader.construct_mapping(node)
+        return CmdPending(value['run'], value.get('ttl'))
     value = loader.construct_scalar(node)
-    return CmdExec(value)
+    return CmdPending(value)
 
 def ctor_file(loader, node):
     value = loader.construct_scalar(node)
+    if _LAZY:
+        if not op.isabs(value):
+            value = op.normpath(op.join(op.dirname(_DFLTFILE), value))
+        return Thunk(FileReader, value)
     return FileReader(value)
 
 def ctor_py(loader, node):
+    _note_volatile()
     seq = loader.construct_sequence(node)
     cmd = seq.pop(0).format(*seq)
     return eval(cmd)
@@ -115,27 +286,58 @@ def ctor_opt(loader, node):
 
 def ctor_ask(loader, node):
     value = loader.construct_scalar(node)
+    if _LAZY:
+        return Thunk(AskPrompter, value)
     return AskPrompter(value)
 
 ##--------------------------------------------------------------#
 ## Configuration Functions                                      #
 ##--------------------------------------------------------------#
 
+def get_cachedir(*names):
+    """Returns the path of the poppage cache directory, optionally joined with
+    the given names. Uses `$XDG_CACHE_HOME` if set."""
+    root = os.environ.get("XDG_CACHE_HOME") or op.join(op.expanduser("~"), ".cache")
+    return op.join(root, "poppage", *names)
+
+def get_sockpath():
+    """Returns the path of the Unix socket used by the serve command. Uses
+    `$POPPAGE_SOCKET` if set."""
+    return os.environ.get("POPPAGE_SOCKET") or get_cachedir("serve.sock")
+
+def use_cache():
+    """Returns true if on-disk caching has been enabled with the
+    `POPPAGE_CACHE` environment variable."""
+    return os.environ.get("POPPAGE_CACHE", "") not in ["", "0"]
+
 def get_cliopts(args):
     opts = {}
-    for key in ['inpath', 'outpath', 'execute']:
+    for key in ['inpath', 'outpath', 'execute', 'contexts', 'scratch']:
         val = args.get("--" + key)
         if val:
             opts[key] = val
-    cmd = [c for c in ['check','debug','make','run'] if args.get(c)]
+    cmd = [c for c in ['batch','check','debug','make','run'] if args.get(c)]
     if cmd:
         opts['command'] = cmd[0]
     opts['runargs'] = args.get('runargs', [])
+    opts['checkvars'] = not args.get('--no-check')
+    try:
+        opts['jobs'] = int(args.get('--jobs') or 1)
+    except ValueError:
+        qprompt.fatal("JOBS must be an integer: `%s`" % (args['--jobs']))
+    opts['processes'] = bool(args.get('--processes'))
+    opts['incremental'] = bool(args.get('--incremental'))
+    opts['linkbins'] = bool(args.get('--link-binaries'))
+    opts['cache'] = use_cache() and not args.get('--no-cache')
+    opts['offline'] = bool(args.get('--offline'))
+    opts['lazy'] = bool(args.get('--lazy'))
     return opts
 
 def get_defopts(dfltdict):
     opts = {}
     if "__opt__" in dfltdict.keys():
+        # Options are always needed so lazy values are resolved up front.
+        resolve_lazy(dfltdict, ['__opt__'])
         for key in ['execute', 'command']:
             opts[key] = (dfltdict.get('__opt__', {}) or {}).get(key)
         for key in ['outpath']:
@@ -160,36 +362,71 @@ def get_defopts(dfltdict):
     return opts
 
 def get_tmpldict(args):
-    # Setup custom YAML tags.
-    yaml.add_constructor(u'!file', ctor_file)
-    yaml.add_constructor(u'!cmd', ctor_cmd)
-    yaml.add_constructor(u'!yaml', ctor_yaml)
-    yaml.add_constructor(u'!opt', ctor_opt)
-    yaml.add_constructor(u'!ask', ctor_ask)
-    yaml.add_constructor(u'!py', ctor_py)
-
     # Prepare template dictionary.
     tmpldict = {}
+    clidict = {}
     dfltfile = args['--defaults']
     if dfltfile:
-        global _DFLTFILE
+        global _DFLTFILE, _DISKCACHE, _CMDCACHE, _LAZY
+        _LAZY = bool(args.get('--lazy'))
         _DFLTFILE = op.abspath(dfltfile)
-        data = fsys.File(dfltfile).read()
-        tmpldict = yaml.load(data, Loader=yaml.Loader)
-    tmpldict = update(tmpldict, {k:v for k,v in zip(args['--string'], args['VAL'])})
-    tmpldict = update(tmpldict, {k:fsys.File(v).read().strip() for k,v in zip(args['--file'], args['PATH'])})
+        _DISKCACHE = use_cache() and not args.get('--no-cache')
+        _CMDCACHE = not args.get('--no-cache')
+        _CMDRESULTS.clear()
+        tmpldict = load_yaml(_DFLTFILE)
+    if type(tmpldict) != dict:
+        qprompt.fatal("Template dictionary is not correct type (%s)!" % (type(tmpldict)))
+    clidict = update(clidict, {k:v for k,v in zip(args['--string'], args['VAL'])})
+    if args.get('--lazy'):
+        clidict = update(clidict, {k:Thunk(_read_file, op.abspath(v)) for k,v in zip(args['--file'], args['PATH'])})
+    else:
+        clidict = update(clidict, {k:_read_file(v) for k,v in zip(args['--file'], args['PATH'])})
 
-    # Handle nested dictionaries.
-    topop = []
-    tmplnest = {}
+    # Handle nested dictionaries. The CLI values are layered over the
+    # defaults rather than merged into them.
     global KEYSEP
     KEYSEP = args['--keysep']
-    if type(tmpldict) != dict:
-        qprompt.fatal("Template dictionary is not correct type (%s)!" % (type(tmpldict)))
+    return LayeredDict(nest_keys(clidict, KEYSEP), nest_keys(tmpldict, KEYSEP))
+
+def _read_file(path):
+    return fsys.File(path).read().strip()
+
+def resolve_lazy(tmpldict, keys=None):
+    """Resolves the thunks nested in the given top-level keys of the template
+    dictionary, or in all keys if None. Pending `!cmd` values are run
+    concurrently. Returns the template dictionary."""
+    if isinstance(tmpldict, LayeredDict):
+        # Resolve in place in every layer so shared layers stay consistent.
+        for layer in tmpldict.maps:
+            resolve_lazy(layer, keys)
+        return tmpldict
+    keys = [k for k in (tmpldict.keys() if keys is None else keys) if k in tmpldict]
+    needed = {k:tmpldict[k] for k in keys}
+    resolve_cmds(needed)
+    for k in keys:
+        tmpldict[k] = _resolve(needed[k])
+    return tmpldict
+
+def _resolve(item):
+    if isinstance(item, Thunk):
+        return item.resolve()
+    if isinstance(item, dict):
+        for k,v in item.items():
+            item[k] = _resolve(v)
+    elif isinstance(item, list):
+        for i,v in enumerate(item):
+            item[i] = _resolve(v)
+    return item
+
+def nest_keys(tmpldict, keysep):
+    """Converts keys containing the given key separator (e.g. `name::first`)
+    into nested dictionaries."""
+    topop = []
+    tmplnest = {}
     for k,v in tmpldict.items():
-        if k.find(KEYSEP) > -1:
+        if k.find(keysep) > -1:
             level = tmplnest
-            ks = k.split(KEYSEP)
+            ks = k.split(keysep)
             for ln,sk in enumerate(ks):
                 level[sk] = level.get(sk, {})
                 if len(ks)-1 == ln:
@@ -222,6 +459,178 @@ def parse(args):
         utildict['outpath'].append(None)
     return utildict, tmpldict
 
+##--------------------------------------------------------------#
+## YAML Loading Functions                                       #
+##--------------------------------------------------------------#
+
+def get_loader():
+    """Returns the YAML loader class with the custom tags registered. The
+    libyaml based loader is used when available."""
+    loader = getattr(yaml, "CLoader", None) or yaml.Loader
+    if not loader.yaml_constructors.get(u'!file'):
+        for tag,ctor in [
+                (u'!file', ctor_file),
+                (u'!cmd', ctor_cmd),
+                (u'!yaml', ctor_yaml),
+                (u'!opt', ctor_opt),
+                (u'!ask', ctor_ask),
+                (u'!py', ctor_py)]:
+            yaml.add_constructor(tag, ctor, Loader=loader)
+    return loader
+
+def load_yaml(path):
+    """Loads the YAML document at the given path. Parsed documents are cached
+    by path and only parsed again when the file, or a file read through a
+    custom tag, changes; documents using `!cmd`, `!ask` or `!py` are never
+    cached. If enabled, the cache is also kept on disk across runs."""
+    path = op.abspath(path)
+    # Relative paths in custom tags are based on the defaults file.
+    key = "%s|%s%s" % (path, op.dirname(_DFLTFILE or path), "|lazy" if _LAZY else "")
+    entry = _DOCCACHE.get(key)
+    if entry is None and _DISKCACHE:
+        entry = _read_doccache(key)
+    if entry != None and all(_statkey(p) == k for p,k in entry['deps'].items()):
+        _DOCCACHE[key] = entry
+        _note_deps(entry['deps'])
+        return pickle.loads(entry['doc'])
+    _LOADING.append({'deps': {path: _statkey(path)}, 'volatile': False})
+    try:
+        data = fsys.File(path).read()
+        doc = yaml.load(data, Loader=get_loader())
+        if not _LAZY:
+            doc = resolve_cmds(doc)
+    finally:
+        load = _LOADING.pop()
+    if load['volatile']:
+        _DOCCACHE.pop(key, None)
+        _note_volatile()
+        return doc
+    _note_deps(load['deps'])
+    try:
+        entry = {'deps': load['deps'], 'doc': pickle.dumps(doc, pickle.HIGHEST_PROTOCOL)}
+    except Exception:
+        return doc
+    _DOCCACHE[key] = entry
+    if _DISKCACHE:
+        _write_doccache(key, entry)
+    return doc
+
+def _statkey(path):
+    """Returns a key for the given file that changes when the file does."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_mtime, stat.st_size]
+
+def _note_deps(deps):
+    """Records files read while loading the current YAML document."""
+    if _LOADING:
+        _LOADING[-1]['deps'].update(deps)
+
+def _note_volatile():
+    """Records that the current YAML document cannot be cached."""
+    if _LOADING:
+        _LOADING[-1]['volatile'] = True
+
+def _doccache_path(key):
+    name = hashlib.sha1(key.encode("utf-8")).hexdigest() + ".pickle"
+    return get_cachedir("yaml", name)
+
+def _read_doccache(key):
+    try:
+        with io.open(_doccache_path(key), "rb") as fi:
+            return pickle.load(fi)
+    except Exception:
+        return None
+
+def _write_doccache(key, entry):
+    cpath = _doccache_path(key)
+    tmppath = "%s.%u.tmp" % (cpath, os.getpid())
+    try:
+        fsys.makedirs(op.dirname(cpath), ignore_extsep=True)
+        with io.open(tmppath, "wb") as fo:
+            pickle.dump(entry, fo, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmppath, cpath)
+    except (IOError, OSError):
+        pass
+
+##--------------------------------------------------------------#
+## Command Functions                                            #
+##--------------------------------------------------------------#
+
+def resolve_cmds(doc):
+    """Runs the commands of the `!cmd` placeholders in the given document and
+    replaces the placeholders with the output. Distinct commands are run
+    concurrently using up to `CMD_JOBS` threads."""
+    pending = []
+    _find_cmds(doc, pending)
+    if isinstance(doc, CmdPending):
+        pending.append((None, None, doc))
+    if not pending:
+        return doc
+    todo = collections.OrderedDict()
+    for _,_,cmd in pending:
+        if cmd.cmd not in _CMDRESULTS:
+            todo.setdefault(cmd.cmd, cmd)
+    if len(todo) > 1:
+        pool = mpool.ThreadPool(min(CMD_JOBS, len(todo)))
+        try:
+            pool.map(lambda c: run_cmd(c.cmd, c.ttl), todo.values())
+        finally:
+            pool.close()
+            pool.join()
+    for parent,key,cmd in pending:
+        value = CmdExec(cmd.cmd, cmd.ttl)
+        if parent is None:
+            return value
+        parent[key] = value
+    return doc
+
+def _find_cmds(item, pending):
+    """Appends a `(parent, key, placeholder)` tuple to `pending` for every
+    `!cmd` placeholder nested in the given item."""
+    if isinstance(item, dict):
+        pairs = item.items()
+    elif isinstance(item, list):
+        pairs = enumerate(item)
+    else:
+        return
+    for key,val in pairs:
+        if isinstance(val, CmdPending):
+            pending.append((item, key, val))
+        else:
+            _find_cmds(val, pending)
+
+def run_cmd(cmd, ttl=None):
+    """Returns the output of the given shell command. Each command only runs
+    once per run. If a TTL in seconds is given, the output is also cached on
+    disk and reused by later runs until it expires."""
+    if cmd in _CMDRESULTS:
+        return _CMDRESULTS[cmd]
+    cpath = None
+    if ttl and _CMDCACHE:
+        key = json.dumps([cmd, os.getcwd()])
+        cpath = get_cachedir("cmd", hashlib.sha1(key.encode("utf-8")).hexdigest() + ".json")
+        try:
+            with io.open(cpath, encoding="utf-8") as fi:
+                entry = json.load(fi)
+            if time.time() - entry['time'] < float(ttl):
+                _CMDRESULTS[cmd] = entry['output']
+                return entry['output']
+        except (IOError, OSError, ValueError, KeyError):
+            pass
+    output = sh.strout(cmd)
+    _CMDRESULTS[cmd] = output
+    if cpath:
+        try:
+            fsys.makedirs(op.dirname(cpath), ignore_extsep=True)
+            with io.open(cpath, "w", encoding="utf-8") as fo:
+                fo.write(json.dumps({'cmd': cmd, 'time': time.time(), 'output': output}))
+        except (IOError, OSError):
+            pass
+    return output
+
 ##==============================================================#
 ## SECTION: Main Body                                           #
 ##==============================================================#
@@ -0,0 +1,326 @@
+"""Times the hot paths of PopPage against synthetic workloads.
+
+Usage:
+    _Run_Benchmarks.py [options]
+
+Options:
+    --files N           Number of files in the generated template tree.
+                        [default: 200]
+    --depth D           Directory depth of the generated template tree.
+                        [default: 3]
+    --lines N           Number of lines in the large single template.
+                        [default: 5000]
+    --keys N            Number of keys in the big YAML defaults file.
+                        [default: 5000]
+    --repeat N          Number of timed runs per benchmark after the first
+                        (cold) run; the best run is compared. [default: 5]
+    --only NAME         Only run benchmarks whose name contains NAME.
+    --save PATH         Write the results as JSON to PATH.
+    --baseline PATH     Compare the results against the JSON results saved
+                        at PATH; exits with 1 if any benchmark regressed.
+    --threshold PCT     Percentage a benchmark may be slower than the
+                        baseline before it counts as a regression; add
+                        comma separated `NAME=PCT` items to set it for
+                        single benchmarks (e.g. `25,parse=50`).
+                        [default: 25]
+    --cold-threshold PCT
+                        Same as `--threshold` but for the first (cold) run,
+                        which is noisier. [default: 50]
+"""
+
+##==============================================================#
+## SECTION: Imports                                             #
+##==============================================================#
+
+import collections
+import io
+import json
+import os
+import os.path as op
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+appdir = op.normpath(op.join(op.abspath(op.dirname(__file__)), "..", "app"))
+sys.path.insert(0, appdir)
+
+from docopt import docopt
+
+import poppage
+import utilconf
+
+##==============================================================#
+## SECTION: Global Definitions                                  #
+##==============================================================#
+
+#: Registered benchmarks as `(name, setup)` pairs in run order; `setup(ws)`
+#: prepares the workload and returns the function to time.
+BENCHMARKS = []
+
+#: Version of the results JSON layout.
+FORMAT = 1
+
+##==============================================================#
+## SECTION: Class Definitions                                   #
+##==============================================================#
+
+class Workspace(object):
+    """Temporary directory holding the generated workloads along with the
+    workload sizes."""
+    def __init__(self, files=200, depth=3, lines=5000, keys=5000):
+        self.files = files
+        self.depth = depth
+        self.lines = lines
+        self.keys = keys
+        self.root = tempfile.mkdtemp(prefix="poppage-bench-")
+    def path(self, *parts):
+        return op.join(self.root, *parts)
+    def write(self, relpath, text):
+        path = self.path(*relpath.split("/"))
+        if not op.isdir(op.dirname(path)):
+            os.makedirs(op.dirname(path))
+        with io.open(path, "w", encoding="utf-8") as fo:
+            fo.write(text)
+        return path
+    def close(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+class Quiet(object):
+    """Sends `stdout` to a null device while active so progress output does
+    not skew timings."""
+    def __enter__(self):
+        self.stdout = sys.stdout
+        sys.stdout = io.open(os.devnull, "w")
+    def __exit__(self, *args):
+        sys.stdout.close()
+        sys.stdout = self.stdout
+
+##==============================================================#
+## SECTION: Function Definitions                                #
+##==============================================================#
+
+def benchmark(name):
+    """Decorator that registers a benchmark setup function."""
+    def wrap(setup):
+        BENCHMARKS.append((name, setup))
+        return setup
+    return wrap
+
+def make_tree(ws):
+    """Generates a template tree with `ws.files` files spread over `ws.depth`
+    levels of directories; file and directory names are templated."""
+    tmpldir = ws.path("tree", "{{project}}")
+    if op.isdir(tmpldir):
+        return tmpldir
+    for i in range(ws.files):
+        dirs = ["{{pkg}}%u" % (i % (d + 2)) for d in range(i % (ws.depth + 1))]
+        relpath = "/".join(["tree", "{{project}}"] + dirs + ["{{prefix}}_%u.py" % (i)])
+        ws.write(relpath, "\n".join([
+            '"""Module {{prefix}}_%u of {{project}}."""' % (i),
+            "{% for n in range(count) %}",
+            "def {{prefix}}_{{n}}():",
+            "    return {{value}} + {{n}}",
+            "{% endfor %}",
+            "{% if author.name %}# Author: {{author.name}} <{{author.email}}>{% endif %}",
+            ""]))
+    return tmpldir
+
+def tree_dict():
+    return {
+            'project': "demo",
+            'pkg': "pkg",
+            'prefix': "func",
+            'count': 10,
+            'value': 42,
+            'author': {'name': "Bench", 'email': "bench@example.com"}}
+
+@benchmark("render_str")
+def bench_render_str(ws):
+    tmplstrs = ["Hello {{name}} #%u, {{items|join(', ')}}!" % (i % 50) for i in range(2000)]
+    tmpldict = {'name': "world", 'items': ["a", "b", "c"]}
+    def run():
+        for tmplstr in tmplstrs:
+            poppage.render_str(tmplstr, tmpldict)
+    return run
+
+@benchmark("render_file")
+def bench_render_file(ws):
+    path = ws.write("large.jinja2", "\n".join(
+        "line %u: {{name}} {{items[%u]}} {%% if flag %%}on{%% endif %%}" % (i, i % 3)
+        for i in range(ws.lines)))
+    tmpldict = {'name': "world", 'items': ["a", "b", "c"], 'flag': True}
+    def run():
+        for _ in range(10):
+            poppage.render_file(path, tmpldict)
+    return run
+
+@benchmark("make_dir")
+def bench_make_dir(ws):
+    tmpldir = make_tree(ws)
+    outdir = ws.path("out")
+    tmpldict = tree_dict()
+    def run():
+        if op.isdir(outdir):
+            shutil.rmtree(outdir)
+        with Quiet():
+            poppage.make_dir(tmpldir, tmpldict, outdir)
+    return run
+
+@benchmark("check")
+def bench_check(ws):
+    tmpldir = make_tree(ws)
+    def run():
+        for _ in range(10):
+            poppage.check(tmpldir)
+    return run
+
+def write_defaults(ws):
+    """Generates a big YAML defaults file that includes other YAML files."""
+    path = ws.path("defaults", "main.yaml")
+    if op.isfile(path):
+        return path
+    parts = 10
+    per = max(ws.keys // parts, 1)
+    lines = []
+    for p in range(parts):
+        inc = ["key%u_%u: value %u" % (p, k, k) for k in range(per // 2)]
+        inc += ["nested%u_%u:\n  a: [%u, %u, %u]\n  b: {c: text, d: %u}" % (p, k, k, k + 1, k + 2, k)
+                for k in range(per - per // 2)]
+        ws.write("defaults/inc%u.yaml" % (p), "\n".join(inc) + "\n")
+        lines.append("part%u: !yaml inc%u.yaml" % (p, p))
+    lines.append("name: main")
+    return ws.write("defaults/main.yaml", "\n".join(lines) + "\n")
+
+def parse_args(dfltfile):
+    return {
+            '--defaults': dfltfile,
+            '--keysep': "::",
+            '--string': ["name"],
+            'VAL': ["cli"],
+            '--file': [],
+            'PATH': [],
+            '--no-cache': True}
+
+@benchmark("parse")
+def bench_parse(ws):
+    dfltfile = write_defaults(ws)
+    def run():
+        utilconf._DOCCACHE.clear()
+        utilconf.parse(parse_args(dfltfile))
+    return run
+
+@benchmark("parse_cached")
+def bench_parse_cached(ws):
+    dfltfile = write_defaults(ws)
+    utilconf.parse(parse_args(dfltfile))
+    def run():
+        for _ in range(20):
+            utilconf.parse(parse_args(dfltfile))
+    return run
+
+def time_func(func, repeat):
+    """Calls the given function `repeat` times after a first call that warms
+    up the caches. Returns the run times in seconds, starting with the first
+    call."""
+    times = []
+    for _ in range(repeat + 1):
+        start = time.time()
+        func()
+        times.append(time.time() - start)
+    return times
+
+def run_benchmarks(ws, repeat=5, only=None):
+    """Runs the registered benchmarks against the given workspace. Returns the
+    results dictionary."""
+    repeat = max(repeat, 1)
+    results = collections.OrderedDict()
+    for name, setup in BENCHMARKS:
+        if only and only not in name:
+            continue
+        times = time_func(setup(ws), repeat)
+        first, times = times[0], times[1:]
+        results[name] = {
+                'first': first,
+                'best': min(times),
+                'mean': sum(times) / len(times),
+                'repeat': repeat}
+        print("%-14s first %8.4fs  best %8.4fs  mean %8.4fs" % (
+            name, first, results[name]['best'], results[name]['mean']))
+    return {
+            'format': FORMAT,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'workload': {'files': ws.files, 'depth': ws.depth, 'lines': ws.lines, 'keys': ws.keys},
+            'benchmarks': results}
+
+def parse_thresholds(spec):
+    """Returns the default threshold percentage and a dictionary of
+    per-benchmark thresholds from the given comma separated `PCT` and
+    `NAME=PCT` items."""
+    default = 25.0
+    named = {}
+    for val in spec.split(","):
+        name, _, pct = val.strip().rpartition("=")
+        if name:
+            named[name] = float(pct)
+        else:
+            default = float(pct)
+    return default, named
+
+def compare(results, baseline, thresholds, cold_thresholds):
+    """Compares the best and first (cold) times of the given results against
+    the baseline results using the given `(default, named)` thresholds as
+    returned by parse_thresholds(). Returns the names of the benchmarks that
+    are slower than their threshold allows."""
+    regressed = []
+    if baseline.get('workload') != results.get('workload'):
+        print("[WARNING] Baseline workload differs: %r" % (baseline.get('workload')))
+    print("")
+    print("%-22s %10s %10s %8s" % ("benchmark", "baseline", "current", "change"))
+    for name, result in results['benchmarks'].items():
+        base = baseline.get('benchmarks', {}).get(name) or {}
+        for key, (default, named) in [("best", thresholds), ("first", cold_thresholds)]:
+            limit = named.get(name, default)
+            label = "%s (%s)" % (name, key)
+            if not base.get(key):
+                print("%-22s %10s %9.4fs %8s" % (label, "-", result[key], "new"))
+                continue
+            change = 100.0 * (result[key] - base[key]) / base[key]
+            flag = ""
+            if change > limit:
+                if name not in regressed:
+                    regressed.append(name)
+                flag = "  REGRESSED (limit +%g%%)" % (limit)
+            print("%-22s %9.4fs %9.4fs %+7.1f%%%s" % (label, base[key], result[key], change, flag))
+    return regressed
+
+##==============================================================#
+## SECTION: Main Body                                           #
+##==============================================================#
+
+if __name__ == '__main__':
+    args = docopt(__doc__)
+    ws = Workspace(
+            files=int(args['--files']),
+            depth=int(args['--depth']),
+            lines=int(args['--lines']),
+            keys=int(args['--keys']))
+    try:
+        results = run_benchmarks(ws, int(args['--repeat']), args['--only'])
+    finally:
+        ws.close()
+    if args['--save']:
+        with open(args['--save'], "w") as fo:
+            json.dump(results, fo, indent=2)
+    if args['--baseline']:
+        with open(args['--baseline']) as fi:
+            baseline = json.load(fi)
+        regressed = compare(results, baseline,
+                parse_thresholds(args['--threshold']),
+                parse_thresholds(args['--cold-threshold']))
+        if regressed:
+            print("[ERROR] The following %u benchmarks regressed: %r" % (len(regressed), regressed))
+            sys.exit(1)
+        print("[DONE] No benchmarks regressed.")
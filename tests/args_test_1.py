@@ -5,6 +5,10 @@
 ##==============================================================#
 
 from testlib import *
+
+import time
+
+import utilconf
 from utilconf import parse
 
 ##==============================================================#
@@ -30,6 +34,149 @@ class TestCase(BaseTest):
         test.assertEqual(utildict['execute'], "bar")
         test.assertEqual(utildict['outpath'], ["__output__/out.py"])
 
+    def test_args_3(test):
+        dfltfile = op.abspath(op.join(OUTDIR, "d.yaml"))
+        def parse_dflt():
+            args = get_args()
+            args['--defaults'] = dfltfile
+            return parse(args)
+        File(dfltfile).write("name: foo\n__opt__:\n  inpath: foo.txt\n")
+        for _ in range(2):
+            # Cached defaults are copied since parsing modifies them.
+            utildict, tmpldict = parse_dflt()
+            test.assertEqual(tmpldict, {'name': "foo"})
+            test.assertEqual(len(utildict['inpath']), 1)
+        test.assertIn("%s|%s" % (dfltfile, op.dirname(dfltfile)), utilconf._DOCCACHE)
+        File(dfltfile).write("name: barbaz\n")
+        test.assertEqual(parse_dflt()[1], {'name': "barbaz"})
+        File(dfltfile).write("name: !py ['\"qux\"']\n")
+        test.assertEqual(parse_dflt()[1], {'name': "qux"})
+        test.assertNotIn("%s|%s" % (dfltfile, op.dirname(dfltfile)), utilconf._DOCCACHE)
+
+    def test_args_4(test):
+        dfltfile = op.abspath(op.join(OUTDIR, "d.yaml"))
+        File(op.join(OUTDIR, "text.txt")).write("foo")
+        File(op.join(OUTDIR, "inc.yaml")).write("num: 5\n")
+        File(dfltfile).write("text: !file text.txt\ninc: !yaml inc.yaml\n")
+        args = get_args()
+        args['--defaults'] = dfltfile
+        test.assertEqual(parse(dict(args))[1], {'text': "foo", 'inc': {'num': 5}})
+        test.assertEqual(parse(dict(args))[1], {'text': "foo", 'inc': {'num': 5}})
+        # Changes to files read through custom tags are picked up.
+        File(op.join(OUTDIR, "text.txt")).write("barbaz")
+        File(op.join(OUTDIR, "inc.yaml")).write("num: 66\n")
+        test.assertEqual(parse(dict(args))[1], {'text': "barbaz", 'inc': {'num': 66}})
+
+    def test_args_5(test):
+        dfltfile = op.abspath(op.join(OUTDIR, "d.yaml"))
+        File(dfltfile).write("name: foo\nnums: [1, 2]\n")
+        args = get_args()
+        args['--defaults'] = dfltfile
+        env = dict(os.environ)
+        try:
+            os.environ['XDG_CACHE_HOME'] = op.abspath(OUTDIR)
+            os.environ['POPPAGE_CACHE'] = "1"
+            test.assertEqual(parse(dict(args))[1], {'name': "foo", 'nums': [1, 2]})
+            test.assertEqual(countfiles(op.join(OUTDIR, "poppage", "yaml")), 1)
+            # A new run starts with an empty memory cache; the defaults file
+            # is not read again since the disk cache is still valid.
+            utilconf._DOCCACHE.clear()
+            utilconf.fsys.File = None
+            test.assertEqual(parse(dict(args))[1], {'name': "foo", 'nums': [1, 2]})
+        finally:
+            del utilconf.fsys.File
+            os.environ.clear()
+            os.environ.update(env)
+
+    def test_args_6(test):
+        import yaml
+        loader = utilconf.get_loader()
+        test.assertEqual(loader, getattr(yaml, "CLoader", yaml.Loader))
+        test.assertIn(u'!file', loader.yaml_constructors)
+
+    def test_args_7(test):
+        dfltfile = op.abspath(op.join(OUTDIR, "d.yaml"))
+        count = op.abspath(op.join(OUTDIR, "count.txt"))
+        File(op.join(OUTDIR, "sleep.py")).write("import sys, time\ntime.sleep(0.5)\nprint(sys.argv[1])\n")
+        File(op.join(OUTDIR, "inc.py")).write("open(%r, 'a').write('x')\nprint('inc')\n" % (count))
+        lines = ["k%u: !cmd python sleep.py %u" % (i, i) for i in range(6)]
+        # Identical commands only run once.
+        lines += ["a: !cmd python inc.py", "b: [!cmd python inc.py]"]
+        File(dfltfile).write("\n".join(lines))
+        args = get_args()
+        args['--defaults'] = dfltfile
+        start = time.time()
+        with Cwd(OUTDIR):
+            tmpldict = parse(args)[1]
+        test.assertTrue(time.time() - start < 2.5)
+        test.assertEqual([tmpldict["k%u" % (i)] for i in range(6)], [str(i) for i in range(6)])
+        test.assertEqual([tmpldict['a'], tmpldict['b']], ["inc", ["inc"]])
+        test.assertEqual(File(count).read(), "x")
+
+    def test_args_8(test):
+        dfltfile = op.abspath(op.join(OUTDIR, "d.yaml"))
+        count = op.abspath(op.join(OUTDIR, "count.txt"))
+        File(op.join(OUTDIR, "inc.py")).write("open(%r, 'a').write('x')\nprint('inc')\n" % (count))
+        File(dfltfile).write("a: !cmd {run: python inc.py, ttl: 60}\nb: !cmd python inc.py\n")
+        env = dict(os.environ)
+        try:
+            os.environ['XDG_CACHE_HOME'] = op.abspath(OUTDIR)
+            args = get_args()
+            args['--defaults'] = dfltfile
+            with Cwd(OUTDIR):
+                for _ in range(2):
+                    test.assertEqual(parse(dict(args))[1], {'a': "inc", 'b': "inc"})
+                # The cached output is reused by the second run.
+                test.assertEqual(File(count).read(), "x")
+                args['--no-cache'] = True
+                parse(dict(args))
+            test.assertEqual(File(count).read(), "xx")
+        finally:
+            os.environ.clear()
+            os.environ.update(env)
+
+    def test_args_9(test):
+        dfltfile = op.abspath(op.join(OUTDIR, "d.yaml"))
+        File(op.join(OUTDIR, "a.txt")).write("foo")
+        File(dfltfile).write("a: !file a.txt\nb: !cmd python -c \"print(5)\"\nc:\n  d: !file missing.txt\n")
+        args = get_args()
+        args['--defaults'] = dfltfile
+        args['--lazy'] = True
+        with Cwd(OUTDIR):
+            tmpldict = parse(args)[1]
+            test.assertTrue(all(isinstance(tmpldict[k], utilconf.Thunk) for k in "ab"))
+            utilconf.resolve_lazy(tmpldict, ["a", "b"])
+        test.assertEqual([tmpldict['a'], tmpldict['b']], ["foo", "5"])
+        test.assertTrue(isinstance(tmpldict['c']['d'], utilconf.Thunk))
+
+    def test_args_10(test):
+        base = {'name': {'first': "A", 'last': "B"}, 'num': 1, 'opts': {'x': 1}}
+        cli = {'name': {'first': "C"}, 'opts': "flat"}
+        merged = utilconf.LayeredDict(cli, base)
+        test.assertEqual(merged, {'name': {'first': "C", 'last': "B"}, 'num': 1, 'opts': "flat"})
+        test.assertEqual(merged.to_dict(), utilconf.update({'name': {'first': "A", 'last': "B"}, 'num': 1}, {'name': {'first': "C"}, 'opts': "flat"}))
+        test.assertEqual(len(merged), 3)
+        # Layers are shared rather than copied and are never modified by
+        # adding a child layer.
+        child = merged.new_child({'num': 2})
+        test.assertEqual([child['num'], merged['num'], base['num']], [2, 1, 1])
+        test.assertIs(utilconf.LayeredDict({}, base)['name'], base['name'])
+        child['new'] = True
+        test.assertNotIn('new', merged)
+        del merged['opts']
+        test.assertNotIn('opts', base)
+        test.assertNotIn('opts', cli)
+
+    def test_args_11(test):
+        base = {'site': {'name': "A", 'maps': "world", 'deep': {'x': 1, 'y': 2}}}
+        cli = {'site': {'name': "B", 'deep': {'y': 3}}}
+        merged = utilconf.LayeredDict(cli, base)
+        site = merged['site']
+        test.assertIs(type(site), dict)
+        test.assertEqual(site, {'name': "B", 'maps': "world", 'deep': {'x': 1, 'y': 3}})
+        test.assertEqual(json.loads(json.dumps(merged.to_dict())), merged.to_dict())
+        test.assertEqual(base['site']['deep'], {'x': 1, 'y': 2})
+
 ##==============================================================#
 ## SECTION: Main Body                                           #
 ##==============================================================#
@@ -0,0 +1,43 @@
+"""Tests the batch() function."""
+
+##==============================================================#
+## SECTION: Imports                                             #
+##==============================================================#
+
+from testlib import *
+
+from poppage import batch, iter_contexts
+
+##==============================================================#
+## SECTION: Class Definitions                                   #
+##==============================================================#
+
+class TestCase(BaseTest):
+
+    def test_batch_1(test):
+        contexts = [{'name':"Mister"}, {'name':"Bob"}]
+        count = batch("./templates/t1.jinja2", {}, contexts, OUTDIR + "/{{name}}.txt")
+        test.assertEqual(count, 2)
+        test.assertEqual(File(OUTDIR + "/Mister.txt").read(), "Hello Mister!" + os.linesep)
+        test.assertEqual(File(OUTDIR + "/Bob.txt").read(), "Hello Bob!" + os.linesep)
+
+    def test_batch_2(test):
+        tmpldict = {'name':{'first':"Mister", 'last':"Bob"}}
+        contexts = [{'name::last':"Jim"}, {}]
+        batch("./templates/t2.jinja2", tmpldict, contexts, OUTDIR + "/{{name.last}}.txt")
+        test.assertEqual(File(OUTDIR + "/Jim.txt").read(), "Hello Mister Jim!" + os.linesep)
+        test.assertEqual(File(OUTDIR + "/Bob.txt").read(), "Hello Mister Bob!" + os.linesep)
+        test.assertEqual(tmpldict['name']['last'], "Bob")
+
+    def test_batch_3(test):
+        contexts = list(iter_contexts("./contexts/c1.jsonl"))
+        test.assertEqual([c['name'] for c in contexts], ["Mister", "Bob", "Jim"])
+        contexts = list(iter_contexts("./contexts/c2.yaml"))
+        test.assertEqual([c['name']['first'] for c in contexts], ["Mister", "Bob"])
+
+##==============================================================#
+## SECTION: Main Body                                           #
+##==============================================================#
+
+if __name__ == '__main__':
+    unittest.main()
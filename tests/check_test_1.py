@@ -36,6 +36,19 @@ class TestCase(BaseTest):
         tvars = check("./templates/t3.jinja2")
         test.assertEqual(sorted(tvars), ["name->first", "name->last", "num"])
 
+    def test_check_6(test):
+        poppage.KEYSEP = "::"
+        path = op.join(OUTDIR, "{{top}}")
+        evars = ["top", "c"]
+        for depth in range(6):
+            makedirs(path, ignore_extsep=True)
+            File(op.join(path, "{{f%u}}.txt" % depth)).write("{{a%u.b}} {{c}}" % depth)
+            evars += ["f%u" % depth, "a%u::b" % depth, "d%u" % depth]
+            path = op.join(path, "{{d%u}}" % depth)
+        makedirs(path, ignore_extsep=True)
+        tvars = check(op.join(OUTDIR, "{{top}}"))
+        test.assertEqual(tvars, sorted(evars))
+
 ##==============================================================#
 ## SECTION: Main Body                                           #
 ##==============================================================#
@@ -0,0 +1,41 @@
+"""Tests script batch CLI call."""
+
+##==============================================================#
+## SECTION: Imports                                             #
+##==============================================================#
+
+from testlib import *
+
+##==============================================================#
+## SECTION: Class Definitions                                   #
+##==============================================================#
+
+class TestCase(BaseTest):
+
+    def test_cli_batch_1(test):
+        errcode = call("batch --inpath ./templates/t1.jinja2 --contexts ./contexts/c1.jsonl --outpath __output__/{{name}}.txt")
+        test.assertEqual(0, errcode)
+        for name in ["Mister", "Bob", "Jim"]:
+            test.assertEqual(File("__output__/%s.txt" % (name)).read(), "Hello %s!" % (name) + os.linesep)
+
+    def test_cli_batch_2(test):
+        errcode = call("batch --inpath ./templates/t3.jinja2 --contexts ./contexts/c2.yaml --outpath __output__/{{num}}.txt --string name::last Bob")
+        test.assertEqual(0, errcode)
+        test.assertEqual(File("__output__/one.txt").read(), "Hello Mister Bob, high one!" + os.linesep)
+        test.assertEqual(File("__output__/two.txt").read(), "Hello Bob Bob, high two!" + os.linesep)
+
+    def test_cli_batch_3(test):
+        errcode = call("batch --inpath ./templates/t1.jinja2 --contexts - --outpath __output__/{{name}}.txt < ./contexts/c1.jsonl")
+        test.assertEqual(0, errcode)
+        test.assertTrue(op.isfile("__output__/Jim.txt"))
+
+    def test_cli_batch_4(test):
+        errcode = call("batch --inpath ./templates/t1.jinja2")
+        test.assertEqual(1, errcode)
+
+##==============================================================#
+## SECTION: Main Body                                           #
+##==============================================================#
+
+if __name__ == '__main__':
+    unittest.main()
@@ -123,6 +123,74 @@ class TestCase(BaseTest):
         test.assertTrue(op.isfile("./__output__/bar.txt"))
         test.assertEqual(File("./__output__/bar.txt").read(), "Hello baz from bar!" + os.linesep)
 
+    def test_cli_make_20(test):
+        errcode = call("make --inpath ./templates/t1.jinja2 --outpath %s --string name Mister --no-check" % (OUTFILE))
+        test.assertEqual(0, errcode)
+        test.assertEqual(File(OUTFILE).read(), "Hello Mister!" + os.linesep)
+
+    def test_cli_make_21(test):
+        errcode = call("make --defaults defaults/d6.yaml --jobs 2")
+        test.assertEqual(0, errcode)
+        test.assertTrue(op.isfile("./__output__/foo/bar.txt"))
+
+    def test_cli_make_22(test):
+        errcode = call("make --defaults defaults/d6.yaml --jobs many")
+        test.assertEqual(1, errcode)
+
+    def test_cli_make_23(test):
+        for _ in range(2):
+            errcode = call("make --defaults defaults/d6.yaml --incremental")
+            test.assertEqual(0, errcode)
+        test.assertTrue(op.isfile("./__output__/foo/bar.txt"))
+        test.assertTrue(op.isfile("./__output__/.poppage-manifest.json"))
+
+    def test_cli_make_24(test):
+        count = op.abspath("./__output__/count.txt")
+        File("./__output__/inc.py").write("open(%r, 'a').write('x')\nprint('inc')\n" % (count))
+        File("./__output__/used.txt").write("Mister")
+        File("./__output__/d.yaml").write("\n".join([
+            "name: !file used.txt",
+            "unused1: !cmd python inc.py",
+            "unused2: !file missing.txt",
+            "unused3: !ask Never asked"]))
+        args = "--defaults ./__output__/d.yaml --file big ./__output__/missing.txt"
+        errcode = call("make --inpath ./templates/t1.jinja2 --outpath %s %s --lazy" % (OUTFILE, args))
+        test.assertEqual(0, errcode)
+        test.assertEqual(File(OUTFILE).read(), "Hello Mister!" + os.linesep)
+        test.assertFalse(op.exists(count))
+
+    def test_cli_make_25(test):
+        File("./__output__/bad.jinja2").write("Hello {{name")
+        File("./__output__/d.yaml").write("\n".join([
+            "name: Mister",
+            "__opt__:",
+            "  command: make",
+            "  inpath: [../templates/t1.jinja2, bad.jinja2, ../templates/t1.jinja2]",
+            "  outpath: [./__output__/a.txt, ./__output__/b.txt, ./__output__/c.txt]"]))
+        errcode = call("make --defaults ./__output__/d.yaml --jobs 2")
+        test.assertEqual(1, errcode)
+        test.assertEqual(File("./__output__/a.txt").read(), "Hello Mister!" + os.linesep)
+        test.assertEqual(File("./__output__/c.txt").read(), "Hello Mister!" + os.linesep)
+        test.assertFalse(op.exists("./__output__/b.txt"))
+
+    def test_cli_make_26(test):
+        File("./__output__/d.yaml").write("site:\n  name: Old\n  maps: world\n")
+        File("./__output__/t.jinja2").write("{{ site|tojson }} {{ site.maps }} {{ site.name }}")
+        errcode = call("make --inpath ./__output__/t.jinja2 --outpath %s --defaults ./__output__/d.yaml --string site::name New" % (OUTFILE))
+        test.assertEqual(0, errcode)
+        test.assertEqual(File(OUTFILE).read(), '{"maps": "world", "name": "New"} world New')
+
+    def test_cli_make_27(test):
+        File("./__output__/out.txt").write("./__output__/out2.txt")
+        File("./__output__/d.yaml").write("\n".join([
+            "name: Mister",
+            "__opt__:",
+            "  inpath: !cmd echo ../templates/t1.jinja2",
+            "  outpath: !file out.txt"]))
+        errcode = call("make --defaults ./__output__/d.yaml --lazy")
+        test.assertEqual(0, errcode)
+        test.assertEqual(File("./__output__/out2.txt").read(), "Hello Mister!" + os.linesep)
+
 ##==============================================================#
 ## SECTION: Main Body                                           #
 ##==============================================================#
@@ -6,6 +6,8 @@
 
 from testlib import *
 
+import time
+
 ##==============================================================#
 ## SECTION: Class Definitions                                   #
 ##==============================================================#
@@ -28,6 +30,75 @@ class TestCase(BaseTest):
         test.assertFalse(op.isfile("__output__/out.py"))
         test.assertEqual(File("__output__/foo.txt").read(), "bar")
 
+    def test_cli_run_3(test):
+        from poppage import run_execute
+        slow = 'python -c "import time; time.sleep(0.5); print(%r)"'
+        execute = "\n".join([
+                "python -c \"open('order.txt', 'w').write('a')\"",
+                "& " + slow % "b",
+                "& " + slow % "c",
+                "&" + slow % "d",
+                "",
+                "python -c \"open('order.txt', 'a').write('e')\""])
+        with Cwd(OUTDIR):
+            start = time.time()
+            results = run_execute(execute)
+            elapsed = time.time() - start
+            test.assertEqual(File("order.txt").read(), "ae")
+        test.assertTrue(elapsed < 1.4, "took %.2fs" % (elapsed))
+        test.assertEqual([r[0] for r in results][1:4], [slow % x for x in "bcd"])
+        test.assertEqual([r[1] for r in results], [0] * 5)
+
+    def test_cli_run_4(test):
+        from poppage import run_execute
+        results = run_execute("& python -c \"import sys; sys.exit(3)\"\n& python -c \"print(1)\"", jobs=1)
+        test.assertEqual([r[1] for r in results], [3, 0])
+        cmd = 'run --inpath ./templates/t5.jinja2 --outpath out.py --execute "{{x}} python {{outpath}}"'
+        cmd += ' --string filename foo.txt --string text bar --string x "&"'
+        test.assertEqual(0, call(cmd))
+        test.assertEqual(File("__output__/foo.txt").read(), "bar")
+
+    def test_cli_run_5(test):
+        scratch = op.abspath(op.join(OUTDIR, "scratch"))
+        record = "python -c \\\"open('outpath.txt', 'w').write('{{outpath}}')\\\""
+        cmd = 'run --inpath ./templates/t1.jinja2 --scratch %s --execute "%s"' % (scratch, record)
+        cmd += ' --string name foo'
+        test.assertEqual(0, call(cmd))
+        outpath = File("outpath.txt").read()
+        delete("outpath.txt")
+        test.assertEqual(op.dirname(outpath), scratch)
+        test.assertFalse(op.exists(outpath))
+        test.assertEqual(os.listdir(scratch), [])
+
+    def test_cli_run_6(test):
+        scratch = op.abspath(op.join(OUTDIR, "scratch"))
+        proc = subprocess.Popen([sys.executable, "../app/poppage.py", "run",
+                "--inpath", "./templates/t1.jinja2", "--scratch", scratch,
+                "--execute", "python -c \"import time; time.sleep(2)\"",
+                "--string", "name", "foo"], stdout=subprocess.PIPE)
+        for _ in range(100):
+            if op.isdir(scratch) and os.listdir(scratch):
+                break
+            sleep(0.05)
+        test.assertEqual(len(os.listdir(scratch)), 1)
+        sleep(0.3)
+        proc.terminate()
+        proc.communicate()
+        test.assertEqual(proc.returncode, 128 + 15)
+        test.assertEqual(os.listdir(scratch), [])
+
+    def test_cli_run_7(test):
+        from poppage import run_execute
+        stdout = sys.stdout
+        sys.stdout = io.StringIO() if sys.version_info >= (3, 0) else io.BytesIO()
+        try:
+            results = run_execute("python -c \"pass\"\n\n  \npython -c \"pass\"\n")
+            printed = sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+        test.assertEqual([r[1] for r in results], [0, 0])
+        test.assertNotIn("OK", printed)
+
 ##==============================================================#
 ## SECTION: Main Body                                           #
 ##==============================================================#
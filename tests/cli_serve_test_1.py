@@ -0,0 +1,114 @@
+"""Tests forwarding CLI calls to the serve daemon."""
+
+##==============================================================#
+## SECTION: Imports                                             #
+##==============================================================#
+
+from testlib import *
+
+##==============================================================#
+## SECTION: Function Definitions                                #
+##==============================================================#
+
+def run_cli(args, sockpath=None, stdin=""):
+    """Runs PopPage as a CLI utility with the given input and returns the exit
+    code and stdout."""
+    env = dict(os.environ)
+    env.pop("POPPAGE_SOCKET", None)
+    if sockpath:
+        env['POPPAGE_SOCKET'] = sockpath
+    proc = subprocess.Popen(
+            [sys.executable, op.join(appdir, "poppage.py")] + args,
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=env, universal_newlines=True)
+    out, _ = proc.communicate(stdin)
+    return proc.returncode, out
+
+def send_request(req, sockpath):
+    """Sends the given request to the serve daemon and returns the list of
+    response messages."""
+    import socket
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(sockpath)
+        sock.sendall((json.dumps(req) + "\n").encode("utf-8"))
+        return [json.loads(line.decode("utf-8")) for line in sock.makefile("rb")]
+    finally:
+        sock.close()
+
+##==============================================================#
+## SECTION: Class Definitions                                   #
+##==============================================================#
+
+class TestCase(BaseTest):
+
+    def setUp(test):
+        super(TestCase, test).setUp()
+        test.sockpath = op.abspath(op.join(OUTDIR, "serve.sock"))
+        test.daemon = subprocess.Popen(
+                [sys.executable, op.join(appdir, "poppage.py"), "serve", "--socket", test.sockpath],
+                stdout=subprocess.PIPE)
+        for _ in range(100):
+            if op.exists(test.sockpath):
+                break
+            sleep(0.05)
+
+    def tearDown(test):
+        test.daemon.terminate()
+        test.daemon.communicate()
+        super(TestCase, test).tearDown()
+
+    def test_cli_serve_1(test):
+        args = ["make", "--inpath", "./templates/t3.jinja2", "--defaults", "./defaults/d1.yaml"]
+        local = run_cli(args)
+        served = run_cli(args, test.sockpath)
+        test.assertEqual(local, (0, "Hello Mister Bob, high five!\n\n"))
+        test.assertEqual(served, local)
+
+    def test_cli_serve_2(test):
+        args = ["make", "--inpath", "./templates/t1.jinja2", "--outpath", OUTFILE, "--string", "name", "Mister"]
+        test.assertEqual(run_cli(args, test.sockpath)[0], 0)
+        test.assertEqual(File(OUTFILE).read(), "Hello Mister!\n")
+        # The daemon stays up after a call fails.
+        test.assertEqual(run_cli(["make", "--string", "a", "b"], test.sockpath), (1, "[FATAL] Must supply INPATH!\n"))
+        test.assertNotEqual(run_cli(["make", "--inpath", OUTFILE, "--defaults", "missing.yaml"], test.sockpath)[0], 0)
+        test.assertEqual(run_cli(["check", "--inpath", "./templates/t1.jinja2"], test.sockpath), (0, "Found variables:\n  name\n"))
+
+    def test_cli_serve_3(test):
+        # Calls fall back to running locally if the daemon is not reachable.
+        args = ["make", "--inpath", "./templates/t1.jinja2", "--string", "name", "Mister"]
+        missing = op.abspath(op.join(OUTDIR, "missing.sock"))
+        test.assertEqual(run_cli(args, missing), (0, "Hello Mister!\n\n"))
+
+    def test_cli_serve_4(test):
+        # Calls that need to prompt are handed back and run locally.
+        File(op.join(OUTDIR, "ask.yaml")).write('name: !ask "Enter a name"\n')
+        args = ["make", "--inpath", "./templates/t1.jinja2", "--defaults", op.join(OUTDIR, "ask.yaml")]
+        local = run_cli(args, stdin="Bob\n")
+        served = run_cli(args, test.sockpath, stdin="Bob\n")
+        test.assertEqual(local[0], 0)
+        test.assertIn("Hello Bob!", local[1])
+        test.assertEqual(served, local)
+        # The daemon still handles calls afterwards.
+        args = ["make", "--inpath", "./templates/t1.jinja2", "--string", "name", "Mister"]
+        test.assertEqual(run_cli(args, test.sockpath), (0, "Hello Mister!\n\n"))
+
+    def test_cli_serve_5(test):
+        req = {'render': {'tmplstr': "Hello {{name.first}}!", 'tmpldict': {'name': {'first': "Bob"}}}}
+        test.assertEqual(send_request(req, test.sockpath), [{'out': "Hello Bob!"}, {'code': 0}])
+        req = {'render': {'inpath': "templates/t1.jinja2", 'tmpldict': {'name': "Mister"}}, 'cwd': os.getcwd()}
+        test.assertEqual(send_request(req, test.sockpath), [{'out': "Hello Mister!\n"}, {'code': 0}])
+        req = {'render': {'tmplstr': "Hello {{name", 'tmpldict': {}}}
+        msgs = send_request(req, test.sockpath)
+        test.assertEqual(msgs[-1], {'code': 1})
+        test.assertIn("TemplateSyntaxError", msgs[0]['err'])
+        # Missing variables are reported apart from the output.
+        msgs = send_request({'render': {'tmplstr': "Hello {{name}}!"}}, test.sockpath)
+        test.assertEqual([m for m in msgs if "err" not in m], [{'out': "Hello !"}, {'code': 0}])
+        test.assertIn("name", "".join(m['err'] for m in msgs if "err" in m))
+
+##==============================================================#
+## SECTION: Main Body                                           #
+##==============================================================#
+
+if __name__ == '__main__':
+    unittest.main()
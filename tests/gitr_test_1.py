@@ -0,0 +1,158 @@
+"""Tests the gitr module against a local stand-in for the GitHub API."""
+
+##==============================================================#
+## SECTION: Imports                                             #
+##==============================================================#
+
+from testlib import *
+
+import hashlib
+
+import gitr
+
+##==============================================================#
+## SECTION: Class Definitions                                   #
+##==============================================================#
+
+class TestCase(BaseTest):
+
+    def setUp(test):
+        super(TestCase, test).setUp()
+        test.ghapi = gitr.GHAPI
+        test.srcdir = op.join(OUTDIR, "src")
+        for d in ["", "a", "a/b", "c"]:
+            for n in range(4):
+                File(op.join(test.srcdir, d, "f%u.txt" % n)).write("%s %u" % (d, n))
+
+    def tearDown(test):
+        gitr.GHAPI = test.ghapi
+        super(TestCase, test).tearDown()
+
+    def test_gitr_1(test):
+        with GitHubStub(test.srcdir) as stub:
+            gitr.GHAPI = stub.api()
+            dstdir = op.join(OUTDIR, "dst")
+            gitr.download(stub.contents(), dstdir, archive=False)
+        test.assertEqual(countfiles(dstdir, recurse=True), 16)
+        test.assertEqual(File(op.join(dstdir, "a", "b", "f3.txt")).read(), "a/b 3")
+        # Connections are kept alive and reused between requests.
+        test.assertEqual(len(stub.requests), 20)
+        test.assertTrue(len(stub.clients) <= gitr.JOBS)
+
+    def test_gitr_2(test):
+        with GitHubStub(test.srcdir) as stub:
+            gitr.GHAPI = stub.api()
+            dstdir = op.join(OUTDIR, "dst")
+            gitr.download(stub.contents("a"), dstdir, jobs=1, archive=False)
+        test.assertEqual(countfiles(dstdir, recurse=True), 8)
+        test.assertFalse(op.exists(op.join(dstdir, "c")))
+
+    def test_gitr_3(test):
+        with GitHubStub(test.srcdir) as stub:
+            gitr.GHAPI = stub.api()
+            dstdir = op.join(OUTDIR, "dst")
+            gitr.download(stub.contents("a", "v1"), dstdir)
+        test.assertEqual(stub.requests, ["/repos/owner/repo/tarball/v1"])
+        test.assertEqual(countfiles(dstdir, recurse=True), 8)
+        test.assertEqual(File(op.join(dstdir, "b", "f3.txt")).read(), "a/b 3")
+        test.assertFalse(op.exists(op.join(dstdir, "c")))
+
+    def test_gitr_4(test):
+        with GitHubStub(test.srcdir) as stub:
+            gitr.GHAPI = stub.api()
+            dstdir = op.join(OUTDIR, "dst")
+            gitr.download(stub.contents(), dstdir)
+        test.assertEqual(len(stub.requests), 1)
+        test.assertEqual(countfiles(dstdir, recurse=True), 16)
+
+    def test_gitr_5(test):
+        with GitHubStub(test.srcdir) as stub:
+            gitr.GHAPI = stub.api()
+            dstdir = op.join(OUTDIR, "dst")
+            gitr.download(stub.contents("missing"), dstdir)
+        test.assertEqual(len(stub.requests), 2)
+        test.assertEqual(countfiles(dstdir, recurse=True), 0)
+
+    def test_gitr_6(test):
+        cachedir = op.join(OUTDIR, "cache")
+        with GitHubStub(test.srcdir) as stub:
+            gitr.GHAPI = stub.api()
+            path1 = gitr.download_cached(stub.contents("a"), cachedir)
+            path2 = gitr.download_cached(stub.contents("a"), cachedir)
+            File(op.join(test.srcdir, "a", "f0.txt")).write("changed")
+            path3 = gitr.download_cached(stub.contents("a"), cachedir)
+        test.assertEqual(path1, path2)
+        test.assertEqual(path1, path3)
+        test.assertEqual(len(stub.requests), 3)
+        test.assertEqual(countfiles(path1, recurse=True), 8)
+        test.assertEqual(File(op.join(path1, "f0.txt")).read(), "changed")
+
+    def test_gitr_7(test):
+        cachedir = op.join(OUTDIR, "cache")
+        sha = "0123456789abcdef0123456789abcdef01234567"
+        with GitHubStub(test.srcdir) as stub:
+            gitr.GHAPI = stub.api()
+            test.assertEqual(gitr.download_cached(stub.contents("a"), cachedir, offline=True), None)
+            path1 = gitr.download_cached(stub.contents("a", sha), cachedir)
+            path2 = gitr.download_cached(stub.contents("a", sha), cachedir)
+            path3 = gitr.download_cached(stub.contents("a", sha), cachedir, offline=True)
+        test.assertEqual(len(stub.requests), 1)
+        test.assertEqual(path1, path2)
+        test.assertEqual(path1, path3)
+        test.assertTrue(gitr.is_pinned(stub.contents("a", sha)))
+        test.assertFalse(gitr.is_pinned(stub.contents("a")))
+
+    def test_gitr_8(test):
+        cachedir = op.join(OUTDIR, "cache")
+        with GitHubStub(test.srcdir) as stub:
+            gitr.GHAPI = stub.api()
+            path1 = gitr.download_cached(stub.contents("a"), cachedir)
+            path2 = gitr.download_cached(stub.contents("c"), cachedir, maxsize=1)
+        # Least recently used entries are pruned but never the requested one.
+        test.assertFalse(op.exists(path1))
+        test.assertEqual(countfiles(path2, recurse=True), 4)
+
+    def test_gitr_9(test):
+        data = bytes(bytearray(range(256))) * 1024
+        with open(op.join(test.srcdir, "c", "blob.bin"), "wb") as fo:
+            fo.write(data)
+        with GitHubStub(test.srcdir) as stub:
+            gitr.GHAPI = stub.api()
+            dstdir = op.join(OUTDIR, "dst")
+            gitr.download(stub.contents("c"), dstdir, archive=False)
+            url = "%s/raw/owner/repo/master/c/blob.bin" % (stub.base)
+            hasher = hashlib.sha256()
+            gitr.download_raw(url, op.join(OUTDIR, "raw.bin"), hasher=hasher)
+        with open(op.join(dstdir, "blob.bin"), "rb") as fi:
+            test.assertEqual(fi.read(), data)
+        with open(op.join(OUTDIR, "raw.bin"), "rb") as fi:
+            test.assertEqual(fi.read(), data)
+        test.assertEqual(hasher.hexdigest(), hashlib.sha256(data).hexdigest())
+
+    def test_gitr_10(test):
+        hasher = gitr.git_blob_hasher
+        try:
+            gitr.git_blob_hasher = lambda size: hashlib.sha1()
+            with GitHubStub(test.srcdir) as stub:
+                gitr.GHAPI = stub.api()
+                with test.assertRaises(Exception):
+                    gitr.download(stub.contents("c"), op.join(OUTDIR, "dst"), archive=False)
+                gitr.download(stub.contents("c"), op.join(OUTDIR, "dst2"), archive=False, verify=False)
+        finally:
+            gitr.git_blob_hasher = hasher
+        test.assertEqual(countfiles(op.join(OUTDIR, "dst2"), recurse=True), 4)
+
+    def test_gitr_11(test):
+        cachedir = op.join(OUTDIR, "cache")
+        with GitHubStub(test.srcdir) as stub:
+            gitr.GHAPI = stub.api()
+            test.assertEqual(None, gitr.download_cached(stub.contents("missing"), cachedir))
+            test.assertEqual(None, gitr.download_cached(stub.contents("missing"), cachedir, offline=True))
+        test.assertEqual(os.listdir(cachedir), [])
+
+##==============================================================#
+## SECTION: Main Body                                           #
+##==============================================================#
+
+if __name__ == '__main__':
+    unittest.main()
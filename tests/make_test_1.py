@@ -6,6 +6,7 @@
 
 from testlib import *
 
+import poppage
 from poppage import make
 
 ##==============================================================#
@@ -60,6 +61,226 @@ class TestCase(BaseTest):
         test.assertTrue(op.isfile("Mister/Bob.txt"))
         delete("Mister")
 
+    def test_make_9(test):
+        tmpldir = op.join(OUTDIR, "tmpl", "{{name}}")
+        for d in ["", "a", "a/{{name}}", "b"]:
+            for n in range(5):
+                File(op.join(tmpldir, d, "{{name}}-%u.txt" % n)).write("Hello {{name}} %u!" % n)
+        for jobs, processes in [(1, False), (4, False), (4, True)]:
+            outdir = op.join(OUTDIR, "out-%u-%u" % (jobs, processes))
+            test.assertTrue(make(tmpldir, {'name':"Mister"}, outdir, jobs=jobs, processes=processes))
+            test.assertEqual(countfiles(op.join(outdir, "Mister"), recurse=True), 20)
+            test.assertEqual(File(op.join(outdir, "Mister", "a", "Mister", "Mister-3.txt")).read(), "Hello Mister 3!")
+
+    def test_make_10(test):
+        tmpldir = op.join(OUTDIR, "tmpl")
+        for n in range(6):
+            File(op.join(tmpldir, "f%u.txt" % n)).write("{{name}}")
+        File(op.join(tmpldir, "f2.txt")).write("{% if %}")
+        File(op.join(tmpldir, "f4.txt")).write("{{ }}")
+        for jobs in [1, 4]:
+            with test.assertRaises(Exception) as ctx:
+                make(tmpldir, {'name':"Mister"}, op.join(OUTDIR, "out"), jobs=jobs)
+            test.assertTrue(ctx.exception.filename.endswith("f2.txt"))
+
+    def test_make_11(test):
+        tmpldir = op.join(OUTDIR, "tmpl")
+        File(op.join(tmpldir, "a.txt")).write("Hello {{a}}!")
+        File(op.join(tmpldir, "b.txt")).write("Hello {{b}}!")
+        outdir = op.join(OUTDIR, "out")
+        apath = op.join(outdir, "tmpl", "a.txt")
+        bpath = op.join(outdir, "tmpl", "b.txt")
+        tmpldict = {'a':"foo", 'b':"bar"}
+        test.assertTrue(make(tmpldir, tmpldict, outdir, incremental=True))
+        test.assertTrue(op.isfile(op.join(outdir, poppage.MANIFEST)))
+        for path in [apath, bpath]:
+            os.utime(path, (0, 0))
+        test.assertTrue(make(tmpldir, tmpldict, outdir, incremental=True))
+        test.assertEqual(os.stat(apath).st_mtime, 0)
+        test.assertEqual(os.stat(bpath).st_mtime, 0)
+        tmpldict['b'] = "baz"
+        test.assertTrue(make(tmpldir, tmpldict, outdir, incremental=True))
+        test.assertEqual(os.stat(apath).st_mtime, 0)
+        test.assertEqual(File(bpath).read(), "Hello baz!")
+        File(apath).write("changed")
+        test.assertTrue(make(tmpldir, tmpldict, outdir, incremental=True, jobs=2))
+        test.assertEqual(File(apath).read(), "Hello foo!")
+
+    @unittest.skipIf(sys.version_info < (3, 4), "tracemalloc needs Python 3.4+")
+    def test_make_12(test):
+        import tracemalloc
+        tmplpath = op.join(OUTDIR, "big.jinja2")
+        File(tmplpath).write("{% for i in range(num) %}{{line}} {{i}}\n{% endfor %}")
+        outpath = op.join(OUTDIR, "big.txt")
+        tmpldict = {'num':100000, 'line':"x" * 100}
+        tracemalloc.start()
+        try:
+            test.assertTrue(make(tmplpath, tmpldict, outpath))
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        test.assertTrue(os.path.getsize(outpath) > 10 * 1024 * 1024)
+        test.assertTrue(peak < 2 * 1024 * 1024)
+
+    def test_make_13(test):
+        tmpldir = op.join(OUTDIR, "tmpl")
+        makedirs(tmpldir, ignore_extsep=True)
+        data = bytes(bytearray(range(256))) * 4096
+        with open(op.join(tmpldir, "a.bin"), "wb") as fo:
+            fo.write(data)
+        File(op.join(tmpldir, "b.txt")).write("Hello {{name}}!")
+        for linkbins in [False, True]:
+            outdir = op.join(OUTDIR, "out-%u" % linkbins)
+            test.assertTrue(make(tmpldir, {'name':"Mister"}, outdir, linkbins=linkbins))
+            binpath = op.join(outdir, "tmpl", "a.bin")
+            with open(binpath, "rb") as fi:
+                test.assertEqual(fi.read(), data)
+            test.assertEqual(op.samefile(binpath, op.join(tmpldir, "a.bin")), linkbins)
+            test.assertEqual(File(op.join(outdir, "tmpl", "b.txt")).read(), "Hello Mister!")
+
+    def test_make_14(test):
+        tmpldir = op.join(OUTDIR, "tmpl")
+        File(op.join(tmpldir, "a.dat")).write("Hello {{name}}!")
+        File(op.join(tmpldir, "b.dat")).write("Hello {{name}}!")
+        File(op.join(tmpldir, "c.png")).write("Hello {{name}}!")
+        File(op.join(tmpldir, poppage.TYPEMAP)).write("binary: [a.dat]\ntext: ['*.png']\n")
+        outdir = op.join(OUTDIR, "out")
+        test.assertTrue(make(tmpldir, {'name':"Mister"}, outdir))
+        test.assertEqual(File(op.join(outdir, "tmpl", "a.dat")).read(), "Hello {{name}}!")
+        test.assertEqual(File(op.join(outdir, "tmpl", "b.dat")).read(), "Hello Mister!")
+        test.assertEqual(File(op.join(outdir, "tmpl", "c.png")).read(), "Hello Mister!")
+        test.assertFalse(op.exists(op.join(outdir, "tmpl", poppage.TYPEMAP)))
+
+    def test_make_15(test):
+        import gitr
+        ghapi = gitr.GHAPI
+        tmpldir = op.join(OUTDIR, "tmpl")
+        File(op.join(tmpldir, "sub", "{{name}}.txt")).write("Hello {{name}}!")
+        try:
+            poppage.use_template_cache(True, op.join(OUTDIR, "cache"))
+            with GitHubStub(tmpldir) as stub:
+                gitr.GHAPI = stub.api()
+                make(stub.contents("sub"), {'name': "foo"}, op.join(OUTDIR, "out1"))
+                make(stub.contents("sub"), {'name': "bar"}, op.join(OUTDIR, "out2"))
+            test.assertEqual(len(stub.requests), 2)
+            for out,name in (("out1","foo"), ("out2","bar")):
+                sub = op.join(OUTDIR, out, os.listdir(op.join(OUTDIR, out))[0])
+                test.assertEqual(File(op.join(sub, name + ".txt")).read(), "Hello %s!" % (name))
+            test.assertEqual(countfiles(op.join(OUTDIR, "cache"), recurse=True), 2)
+        finally:
+            gitr.GHAPI = ghapi
+            poppage.use_template_cache(False)
+
+    def test_make_16(test):
+        import gitr
+        ghapi = gitr.GHAPI
+        tmpldir = op.join(OUTDIR, "tmpl")
+        File(op.join(tmpldir, "sub", "{{name}}.txt")).write("Hello {{name}}!")
+        File(op.join(tmpldir, "other", "b.txt")).write("Bye {{name}}!")
+        try:
+            with GitHubStub(tmpldir) as stub:
+                gitr.GHAPI = stub.api()
+                targets = [
+                        (stub.contents("sub"), op.join(OUTDIR, "out1")),
+                        (stub.contents("other"), op.join(OUTDIR, "out2")),
+                        (stub.contents("sub"), op.join(OUTDIR, "out3"))]
+                results = poppage.make_targets(targets, {'name': "foo"}, jobs=3)
+            test.assertEqual([r[2] for r in results], [None] * 3)
+            # The repository tarball is only downloaded once.
+            test.assertEqual(len(stub.requests), 1)
+            for out,fname,text in (("out1","foo.txt","Hello foo!"), ("out2","b.txt","Bye foo!"), ("out3","foo.txt","Hello foo!")):
+                sub = op.join(OUTDIR, out, os.listdir(op.join(OUTDIR, out))[0])
+                test.assertEqual(File(op.join(sub, fname)).read(), text)
+        finally:
+            gitr.GHAPI = ghapi
+
+    def test_make_17(test):
+        File(op.join(OUTDIR, "bad.jinja2")).write("Hello {{name")
+        targets = [
+                ("./templates/t1.jinja2", op.join(OUTDIR, "a.txt")),
+                (op.join(OUTDIR, "bad.jinja2"), op.join(OUTDIR, "b.txt")),
+                ("./templates/t1.jinja2", op.join(OUTDIR, "c.txt"))]
+        for jobs in (1, 2):
+            results = poppage.make_targets(targets, {'name': "Mister"}, jobs=jobs)
+            test.assertEqual([r[2] is None for r in results], [True, False, True])
+            test.assertIn("TemplateSyntaxError", results[1][2])
+            test.assertEqual(File(op.join(OUTDIR, "c.txt")).read(), "Hello Mister!" + os.linesep)
+            delete(op.join(OUTDIR, "c.txt"))
+
+    def test_make_18(test):
+        File(OUTFILE).write("GOOD OLD CONTENT")
+        tmplpath = op.join(OUTDIR, "fails.jinja2")
+        File(tmplpath).write("line 1\nline 2\n{{ items[5] + missing.attr }}\n")
+        with test.assertRaises(Exception):
+            make(tmplpath, {'items': []}, OUTFILE)
+        test.assertEqual(File(OUTFILE).read(), "GOOD OLD CONTENT")
+        test.assertEqual([f for f in os.listdir(OUTDIR) if "__temp-poppage-" in f], [])
+
+    def test_make_19(test):
+        tmpldir = op.join(OUTDIR, "tmpl")
+        for i in range(50):
+            File(op.join(tmpldir, "{{name}}-%u.txt" % (i))).write("Hello {{name}}!")
+        stdout = sys.stdout
+        sys.stdout = io.StringIO() if sys.version_info >= (3, 0) else io.BytesIO()
+        try:
+            test.assertTrue(make(tmpldir, {'name':"Mister"}, op.join(OUTDIR, "out"), jobs=8))
+            lines = sys.stdout.getvalue().splitlines()
+        finally:
+            sys.stdout = stdout
+        writes = [l for l in lines if l.startswith("[!] Writing")]
+        test.assertEqual(len(writes), 50)
+        for line in writes:
+            test.assertEqual(line.count("[!]"), 1)
+            test.assertTrue(line.endswith("DONE."))
+
+    def test_make_20(test):
+        tmpldir = op.join(OUTDIR, "tmpl")
+        File(op.join(tmpldir, "main.txt")).write("Hello {{a}} {% include 'parts/p.txt' %}")
+        File(op.join(tmpldir, "parts", "p.txt")).write("and {% include 'q.txt' %}")
+        File(op.join(tmpldir, "q.txt")).write("{{q}}!")
+        outpath = op.join(OUTDIR, "out.txt")
+        tmpldict = {'a':"foo", 'q':"bar"}
+        test.assertTrue(make(op.join(tmpldir, "main.txt"), tmpldict, outpath, incremental=True))
+        test.assertEqual(File(outpath).read(), "Hello foo and bar!")
+        File(op.join(tmpldir, "q.txt")).write("{{q}}?")
+        test.assertTrue(make(op.join(tmpldir, "main.txt"), tmpldict, outpath, incremental=True))
+        test.assertEqual(File(outpath).read(), "Hello foo and bar?")
+        tmpldict['q'] = "baz"
+        test.assertTrue(make(op.join(tmpldir, "main.txt"), tmpldict, outpath, incremental=True))
+        test.assertEqual(File(outpath).read(), "Hello foo and baz?")
+
+    def test_make_21(test):
+        names = ["a.txt", "b.txt", "c.txt", "d.txt", "e.txt", "f.txt"]
+        targets = [("./templates/t1.jinja2", op.join(OUTDIR, name)) for name in names]
+        results = poppage.make_targets(targets, {'name': "Mister"}, jobs=len(names), incremental=True)
+        test.assertEqual([r[2] for r in results], [None] * len(names))
+        with io.open(op.join(OUTDIR, poppage.MANIFEST), encoding="utf-8") as fi:
+            test.assertEqual(sorted(json.load(fi).keys()), names)
+        test.assertEqual([f for f in os.listdir(OUTDIR) if "__temp-poppage-" in f], [])
+
+    def test_make_22(test):
+        import gitr
+        ghapi = gitr.GHAPI
+        link = os.link
+        tmpldir = op.join(OUTDIR, "tmpl")
+        makedirs(op.join(tmpldir, "sub"), ignore_extsep=True)
+        with open(op.join(tmpldir, "sub", "a.bin"), "wb") as fo:
+            fo.write(b"\x00\x01\x02")
+        try:
+            def fail(*args):
+                raise OSError("No hardlinks")
+            os.link = fail
+            with GitHubStub(tmpldir) as stub:
+                gitr.GHAPI = stub.api()
+                test.assertTrue(make(stub.contents("sub"), {}, op.join(OUTDIR, "out"), linkbins=True))
+        finally:
+            os.link = link
+            gitr.GHAPI = ghapi
+        sub = op.join(OUTDIR, "out", os.listdir(op.join(OUTDIR, "out"))[0])
+        test.assertFalse(op.islink(op.join(sub, "a.bin")))
+        with open(op.join(sub, "a.bin"), "rb") as fi:
+            test.assertEqual(fi.read(), b"\x00\x01\x02")
+
 ##==============================================================#
 ## SECTION: Main Body                                           #
 ##==============================================================#
@@ -0,0 +1,153 @@
+"""Tests the render_str() and render_file() functions."""
+
+##==============================================================#
+## SECTION: Imports                                             #
+##==============================================================#
+
+from testlib import *
+
+import poppage
+from poppage import render_file, render_str
+
+##==============================================================#
+## SECTION: Class Definitions                                   #
+##==============================================================#
+
+class TestCase(BaseTest):
+
+    def setUp(test):
+        super(TestCase, test).setUp()
+        poppage._TMPLCACHE.clear()
+        poppage._INFERCACHE.clear()
+
+    def test_render_1(test):
+        text = render_str("Hello {{name}}!", {'name':"Mister"})
+        test.assertEqual(text, "Hello Mister!")
+
+    def test_render_2(test):
+        render_str("Hello {{name}}!", {'name':"Mister"})
+        text = render_str("Hello {{name}}!", {'name':"Bob"})
+        test.assertEqual(text, "Hello Bob!")
+        info = poppage.cache_info()
+        test.assertEqual(info['misses'], 1)
+        test.assertEqual(info['hits'], 1)
+
+    def test_render_3(test):
+        text = render_file("./templates/t1.jinja2", {'name':"Mister"})
+        test.assertEqual(text, "Hello Mister!\n")
+        text = render_file("./templates/t1.jinja2", {'name':"Bob"})
+        test.assertEqual(text, "Hello Bob!\n")
+        info = poppage.cache_info()
+        test.assertEqual(info['misses'], 1)
+        test.assertEqual(info['hits'], 1)
+
+    def test_render_4(test):
+        tmplpath = op.join(OUTDIR, "tmpl.jinja2")
+        File(tmplpath).write("Hello {{name}}!")
+        test.assertEqual(render_file(tmplpath, {'name':"Mister"}), "Hello Mister!")
+        File(tmplpath).write("Goodbye {{name}}!")
+        test.assertEqual(render_file(tmplpath, {'name':"Mister"}), "Goodbye Mister!")
+
+    def test_render_5(test):
+        cache = poppage.TemplateCache(maxsize=2)
+        for key in ["a", "b", "c"]:
+            cache.get(key, lambda: key)
+        test.assertEqual(len(cache), 2)
+        test.assertEqual(cache.get("a", lambda: "new"), "new")
+        test.assertEqual(cache.get("c", lambda: "new"), "c")
+
+    def test_render_6(test):
+        test.assertEqual(poppage.check_template("{{a}}/{{b}}", {'a':1}), ["b"])
+        test.assertEqual(poppage.check_template("{{a}}/{{b}}", {'b':1}), ["a"])
+        info = poppage._INFERCACHE.info()
+        test.assertEqual(info['misses'], 1)
+        test.assertEqual(info['hits'], 1)
+
+    def test_render_7(test):
+        text = render_str("Hello {{name}}!", {}, checkvars=False)
+        test.assertEqual(text, "Hello !")
+        test.assertEqual(len(poppage._INFERCACHE), 0)
+
+    def test_render_8(test):
+        cachedir = op.join(OUTDIR, "cache")
+        poppage.use_bytecode_cache(directory=cachedir)
+        try:
+            test.assertEqual(render_file("./templates/t1.jinja2", {'name':"Mister"}), "Hello Mister!\n")
+            test.assertEqual(countfiles(cachedir), 1)
+            poppage._TMPLCACHE.clear()
+            test.assertEqual(render_file("./templates/t1.jinja2", {'name':"Bob"}), "Hello Bob!\n")
+            test.assertEqual(countfiles(cachedir), 1)
+        finally:
+            poppage.use_bytecode_cache(False)
+
+    def test_render_9(test):
+        cachedir = op.join(OUTDIR, "cache")
+        File(op.join(OUTDIR, "a.txt")).write("Hello {{name}}!")
+        File(op.join(OUTDIR, "b.txt")).write("Goodbye {{name}}!")
+        poppage.use_bytecode_cache(directory=cachedir, maxsize=1)
+        try:
+            render_file(op.join(OUTDIR, "a.txt"), {'name':"Mister"})
+            render_file(op.join(OUTDIR, "b.txt"), {'name':"Mister"})
+            test.assertEqual(countfiles(cachedir), 0)
+        finally:
+            poppage.use_bytecode_cache(False)
+
+    def test_render_10(test):
+        tmplpath = op.join(OUTDIR, "tmpl.foo")
+        File(tmplpath).write("Hello {{name}}!")
+        poppage._SRCCACHE.clear()
+        test.assertEqual(poppage.classify(tmplpath), "text")
+        test.assertEqual(poppage._SRCCACHE.peek(("missing", 0, 0)), None)
+        test.assertEqual(len(poppage._SRCCACHE), 1)
+        test.assertEqual(render_file(tmplpath, {'name':"Mister"}), "Hello Mister!")
+        test.assertEqual(poppage._SRCCACHE.info()['hits'], 1)
+        # The text is dropped once handed to the template loader.
+        test.assertEqual(len(poppage._SRCCACHE), 0)
+        with open(op.join(OUTDIR, "data.foo"), "wb") as fo:
+            fo.write(bytes(bytearray(range(256))) * 4)
+        test.assertEqual(poppage.classify(op.join(OUTDIR, "data.foo")), "binary")
+
+    @unittest.skipIf(sys.version_info < (3, 4), "tracemalloc needs Python 3.4+")
+    def test_render_11(test):
+        import tracemalloc
+        path = op.join(OUTDIR, "big.dat")
+        with open(path, "wb") as fo:
+            fo.write(b"text line\n" * (poppage.SOURCE_CACHE_SIZE // 5))
+        poppage._SRCCACHE.clear()
+        tracemalloc.start()
+        try:
+            test.assertEqual(poppage.classify(path), "text")
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        test.assertTrue(peak < poppage.SOURCE_CACHE_SIZE, "peak was %u bytes" % (peak))
+        test.assertEqual(len(poppage._SRCCACHE), 0)
+        File(op.join(OUTDIR, "empty.dat")).write("")
+        test.assertEqual(poppage.classify(op.join(OUTDIR, "empty.dat")), "text")
+
+    def test_render_12(test):
+        File(op.join(OUTDIR, poppage.TYPEMAP)).write("binary: ['*']\n")
+        tmpldir = op.join(OUTDIR, "tmpl")
+        File(op.join(tmpldir, "a.txt")).write("Hello {{name}}!")
+        # Type maps outside the template root are ignored.
+        test.assertEqual(poppage.classify(op.join(tmpldir, "a.txt"), tmpldir), "text")
+        test.assertEqual(poppage.classify(op.join(tmpldir, "a.txt"), OUTDIR), "binary")
+        tree = poppage.Renderer().render_tree(tmpldir, {'name': "foo"})
+        test.assertEqual(tree["a.txt"], "Hello foo!")
+
+    def test_render_13(test):
+        cachedir = op.join(OUTDIR, "cache")
+        poppage.use_bytecode_cache(directory=cachedir)
+        try:
+            for i in range(3):
+                render_str("/tmp/__temp-poppage-%u/{{name}}" % (i), {'name':"Mister"})
+            test.assertEqual(countfiles(cachedir), 0)
+        finally:
+            poppage.use_bytecode_cache(False)
+
+##==============================================================#
+## SECTION: Main Body                                           #
+##==============================================================#
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+"""Tests the embeddable Renderer API."""
+
+##==============================================================#
+## SECTION: Imports                                             #
+##==============================================================#
+
+from testlib import *
+
+from multiprocessing.pool import ThreadPool
+
+from jinja2 import StrictUndefined, UndefinedError
+
+from poppage import Renderer
+
+##==============================================================#
+## SECTION: Class Definitions                                   #
+##==============================================================#
+
+class TestCase(BaseTest):
+
+    def test_renderer_1(test):
+        warnings = []
+        renderer = Renderer(warn=warnings.append)
+        test.assertEqual(renderer.render_str("Hello {{name}}!", {'name': "world"}), "Hello world!")
+        test.assertEqual(renderer.render_str("Hello {{name}}{{x.y}}!", {'name': "world"}), "Hello world!")
+        test.assertEqual(warnings, ["Template vars `x::y` were not supplied values!"])
+        renderer.render_str("{{x.y}}", {}, checkvars=False)
+        test.assertEqual(len(warnings), 1)
+
+    def test_renderer_2(test):
+        renderer = Renderer(keysep="/", undefined=StrictUndefined)
+        test.assertEqual(renderer.missing("{{a.b}} {{c}}", {'c': 1}), ["a/b"])
+        with test.assertRaises(UndefinedError):
+            renderer.render_str("Hello {{name}}!", {})
+
+    def test_renderer_3(test):
+        tmplpath = op.join(OUTDIR, "t.txt")
+        File(tmplpath).write("Hello {{name}}!\n")
+        renderer = Renderer()
+        test.assertEqual(renderer.render_file(tmplpath, {'name': "file"}), "Hello file!\n")
+        fo = io.StringIO()
+        test.assertIs(renderer.render_file(tmplpath, {'name': "stream"}, fo=fo), fo)
+        test.assertEqual(fo.getvalue(), "Hello stream!\n")
+        test.assertEqual("".join(renderer.stream_file(tmplpath, {'name': "chunks"})), "Hello chunks!\n")
+
+    def test_renderer_4(test):
+        tmpldir = op.join(OUTDIR, "tmpl")
+        File(op.join(tmpldir, "{{name}}.txt")).write("Hello {{name}}!")
+        File(op.join(tmpldir, "sub", "b.txt")).write("{{num}}")
+        data = bytes(bytearray(range(256))) * 4
+        with open(op.join(tmpldir, "sub", "{{name}}.bin"), "wb") as fo:
+            fo.write(data)
+        tree = Renderer().render_tree(tmpldir, {'name': "foo", 'num': 5})
+        test.assertEqual(list(tree.keys()), ["foo.txt", "sub/b.txt", "sub/foo.bin"])
+        test.assertEqual(tree["foo.txt"], "Hello foo!")
+        test.assertEqual(tree["sub/b.txt"], "5")
+        test.assertEqual(tree["sub/foo.bin"], data)
+        # Nothing is written to disk.
+        test.assertEqual(countfiles(tmpldir, recurse=True), 3)
+
+    def test_renderer_5(test):
+        renderer = Renderer()
+        tmplstrs = ["{{n}} %u" % (i % 10) for i in range(200)]
+        def render(i):
+            return renderer.render_str(tmplstrs[i], {'n': i})
+        pool = ThreadPool(8)
+        try:
+            results = pool.map(render, range(200))
+        finally:
+            pool.close()
+            pool.join()
+        test.assertEqual(results, ["%u %u" % (i, i % 10) for i in range(200)])
+        test.assertEqual(len(renderer.tmplcache), 10)
+
+    def test_renderer_6(test):
+        from utilconf import Thunk
+        calls = []
+        def value():
+            calls.append(1)
+            return "lazy"
+        tmpldict = {'x': Thunk(value), 'y': Thunk(value)}
+        # Thunks missed by the analysis still render by resolving themselves.
+        test.assertEqual(Renderer().render_str("{{x}} {{x}}", tmpldict), "lazy lazy")
+        test.assertEqual(len(calls), 1)
+
+    def test_renderer_7(test):
+        File(op.join(OUTDIR, "part.txt")).write("Part {{name}}")
+        File(op.join(OUTDIR, "base.txt")).write("[{% block body %}{% endblock %}]")
+        File(op.join(OUTDIR, "main.txt")).write('{% include "part.txt" %}!')
+        File(op.join(OUTDIR, "child.txt")).write('{% extends "base.txt" %}{% block body %}{{name}}{% endblock %}')
+        renderer = Renderer()
+        test.assertEqual(renderer.render_file(op.join(OUTDIR, "main.txt"), {'name': "one"}), "Part one!")
+        test.assertEqual(renderer.render_file(op.join(OUTDIR, "child.txt"), {'name': "two"}), "[two]")
+
+    def test_renderer_8(test):
+        from poppage import TemplateReadError
+        tmplpath = op.join(OUTDIR, "latin1.txt")
+        with open(tmplpath, "wb") as fo:
+            fo.write(b"Caf\xe9 {{name}}")
+        warnings = []
+        stdout = sys.stdout
+        sys.stdout = io.StringIO() if sys.version_info >= (3, 0) else io.BytesIO()
+        try:
+            with test.assertRaises(TemplateReadError):
+                Renderer(warn=warnings.append).render_file(tmplpath, {})
+            with test.assertRaises(TemplateReadError):
+                Renderer().render_file(tmplpath, {})
+            printed = sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+        test.assertEqual(printed, "")
+        test.assertEqual(warnings, ["Issue while decoding template with `utf-8`!"])
+
+    def test_renderer_9(test):
+        import poppage
+        renderer = Renderer()
+        for i in range(poppage.ENV_CACHE_SIZE + 8):
+            dirpath = op.join(OUTDIR, "d%u" % (i))
+            File(op.join(dirpath, "part.txt")).write("part %u" % (i))
+            File(op.join(dirpath, "t.txt")).write("{% include 'part.txt' %}!")
+            test.assertEqual(renderer.render_file(op.join(dirpath, "t.txt"), {}), "part %u!" % (i))
+        test.assertEqual(len(renderer._overlays), poppage.ENV_CACHE_SIZE)
+        test.assertEqual(len(renderer._envs), 1)
+
+##==============================================================#
+## SECTION: Main Body                                           #
+##==============================================================#
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+"""Tests that importing the app stays fast by deferring heavy dependencies."""
+
+##==============================================================#
+## SECTION: Imports                                             #
+##==============================================================#
+
+from testlib import *
+
+##==============================================================#
+## SECTION: Global Definitions                                  #
+##==============================================================#
+
+#: Dependencies that must not be imported just by loading the app.
+DEFERRED = [
+        "auxly",
+        "binaryornot",
+        "jinja2_time",
+        "jinja2schema",
+        "multiprocessing.pool",
+        "qprompt",
+        "requests",
+        "yaml"]
+
+#: Budget in microseconds for `import poppage` as reported by `-X importtime`;
+#: the best of a few runs is used to smooth out noise. Generous by default
+#: for shared CI runners; can be set with `POPPAGE_IMPORT_BUDGET`.
+IMPORT_BUDGET = int(os.environ.get("POPPAGE_IMPORT_BUDGET") or 400000)
+
+##==============================================================#
+## SECTION: Function Definitions                                #
+##==============================================================#
+
+def import_poppage(code=""):
+    """Imports poppage in a fresh interpreter, runs the given code and returns
+    the stdout along with the `-X importtime` report."""
+    script = "import sys; sys.path.insert(0, %r); import poppage; %s" % (appdir, code)
+    proc = subprocess.Popen(
+            [sys.executable, "-X", "importtime", "-c", script],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    out, err = proc.communicate()
+    return out, err
+
+def import_time(report, module):
+    """Returns the cumulative import time in microseconds of the given module
+    from the given `-X importtime` report."""
+    for line in report.splitlines():
+        tok = line.split("|")
+        if len(tok) == 3 and tok[2].strip() == module:
+            return int(tok[1])
+
+##==============================================================#
+## SECTION: Class Definitions                                   #
+##==============================================================#
+
+class TestCase(BaseTest):
+
+    def test_startup_1(test):
+        out, _ = import_poppage("print(' '.join(sorted(sys.modules)))")
+        loaded = out.split()
+        for name in DEFERRED:
+            test.assertNotIn(name, loaded)
+
+    def test_startup_2(test):
+        path = op.abspath(op.join(OUTDIR, "file.xyz"))
+        File(path).write("data")
+        out, _ = import_poppage("poppage.classify(%r); poppage.infer_vars('{{a}}'); print(' '.join(sorted(sys.modules)))" % (path))
+        loaded = out.split()
+        test.assertIn("binaryornot.helpers", loaded)
+        test.assertIn("jinja2schema", loaded)
+        test.assertNotIn("requests", loaded)
+
+    @unittest.skipIf(sys.version_info < (3, 7), "-X importtime needs Python 3.7+")
+    def test_startup_3(test):
+        times = [import_time(import_poppage()[1], "poppage") for _ in range(3)]
+        test.assertTrue(min(times) < IMPORT_BUDGET, "import took %uus" % (min(times)))
+
+##==============================================================#
+## SECTION: Main Body                                           #
+##==============================================================#
+
+if __name__ == '__main__':
+    unittest.main()
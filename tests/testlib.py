@@ -5,15 +5,30 @@
 ##==============================================================#
 
 
+import gzip
+import hashlib
+import io
+import json
 import os
 import os.path as op
 import random
 from string import ascii_uppercase
 import subprocess
 import sys
+import tarfile
+import threading
 import unittest
 from time import sleep
 
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse
+
 from auxly.filesys import Cwd, File, delete, makedirs, countfiles
 import auxly.shell as sh
 
@@ -42,6 +57,103 @@ class BaseTest(unittest.TestCase):
             try: delete("./__output__")
             except: pass
 
+class GitHubStub(object):
+    """Local stand-in HTTP server that mimics the GitHub contents API for the
+    files under the given directory. Requests and client connections are
+    recorded. Responses carry an ETag and conditional requests for unchanged
+    content get `304 Not Modified`. Use as a context manager."""
+    def __init__(stub, rootdir, owner="owner", repo="repo"):
+        stub.rootdir = op.abspath(rootdir)
+        stub.owner = owner
+        stub.repo = repo
+        stub.requests = []
+        stub.clients = set()
+        stub.server = None
+    def __enter__(stub):
+        class Server(ThreadingMixIn, HTTPServer):
+            daemon_threads = True
+        stub.server = Server(("127.0.0.1", 0), stub._handler())
+        stub.base = "http://127.0.0.1:%u" % (stub.server.server_address[1])
+        thread = threading.Thread(target=stub.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return stub
+    def __exit__(stub, *args):
+        stub.server.shutdown()
+        stub.server.server_close()
+    def api(stub):
+        """Returns the URL to use in place of `gitr.GHAPI`."""
+        return stub.base + "/repos/"
+    def contents(stub, path="", ref="master"):
+        return "%s%s/%s/contents/%s?ref=%s" % (stub.api(), stub.owner, stub.repo, path, ref)
+    def _handler(stub):
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            def log_message(self, *args):
+                pass
+            def do_GET(self):
+                stub.requests.append(self.path)
+                stub.clients.add(self.client_address)
+                url = urlparse(self.path)
+                tok = url.path.strip("/").split("/")
+                if tok[:1] == ["raw"]:
+                    return self.send_file(op.join(stub.rootdir, *tok[4:]))
+                if tok[3:4] == ["tarball"]:
+                    return self.send_tarball("".join(tok[4:5]) or "master")
+                if tok[3:4] == ["contents"]:
+                    ref = url.query.replace("ref=", "")
+                    return self.send_listing("/".join(tok[4:]), ref)
+                self.send(404, b"{}")
+            def send(self, code, body, ctype="application/json", etag=None):
+                if 200 == code:
+                    etag = '"%s"' % (etag or hashlib.sha1(body).hexdigest())
+                    if self.headers.get("If-None-Match") == etag:
+                        code, body = 304, b""
+                self.send_response(code)
+                self.send_header("Content-Type", ctype)
+                self.send_header("Content-Length", str(len(body)))
+                if etag:
+                    self.send_header("ETag", etag)
+                self.end_headers()
+                self.wfile.write(body)
+            def send_file(self, path):
+                if not op.isfile(path):
+                    return self.send(404, b"{}")
+                with io.open(path, "rb") as fi:
+                    self.send(200, fi.read(), "application/octet-stream")
+            def send_tarball(self, ref):
+                buf = io.BytesIO()
+                with tarfile.open(fileobj=buf, mode="w") as tar:
+                    tar.add(stub.rootdir, arcname="%s-%s-%s" % (stub.owner, stub.repo, ref))
+                etag = hashlib.sha1(buf.getvalue()).hexdigest()
+                gzbuf = io.BytesIO()
+                with gzip.GzipFile(fileobj=gzbuf, mode="wb") as fo:
+                    fo.write(buf.getvalue())
+                self.send(200, gzbuf.getvalue(), "application/x-gzip", etag)
+            def send_listing(self, path, ref):
+                dirpath = op.join(stub.rootdir, *path.split("/"))
+                if not op.isdir(dirpath):
+                    return self.send(404, b'{"message": "Not Found"}')
+                items = []
+                for name in sorted(os.listdir(dirpath)):
+                    ipath = "/".join([p for p in [path, name] if p])
+                    isfile = op.isfile(op.join(dirpath, name))
+                    data = b""
+                    if isfile:
+                        with io.open(op.join(dirpath, name), "rb") as fi:
+                            data = fi.read()
+                    items.append({
+                        'name': name,
+                        'path': ipath,
+                        'size': len(data),
+                        'sha': hashlib.sha1(b"blob %u\0" % (len(data)) + data).hexdigest() if isfile else None,
+                        'type': "file" if isfile else "dir",
+                        'url': stub.contents(ipath, ref),
+                        'download_url': "%s/raw/%s/%s/%s/%s" % (
+                            stub.base, stub.owner, stub.repo, ref, ipath) if isfile else None})
+                self.send(200, json.dumps(items).encode("utf-8"))
+        return Handler
+
 ##==============================================================#
 ## SECTION: Function Definitions                                #
 ##==============================================================#